@@ -1,11 +1,53 @@
+import io
 import os
 import re
 import csv
-from io import StringIO
-from flask import Flask, render_template, request, jsonify, send_from_directory, send_file
+import mmap
+import json
+import uuid
+import queue
+import tarfile
+import datetime
+import pickle
+import shutil
+import wave
+import struct
+import time
+import fcntl
+import sqlite3
+import gzip
+import hashlib
+import random
+import cProfile
+import pstats
+import threading
+import subprocess
+from io import StringIO, BytesIO
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import click
+import numpy as np
+from flask import (Flask, Response, render_template, request, jsonify, send_from_directory, send_file,
+                   stream_with_context, redirect, url_for)
 from flask_cors import CORS
 from pydub import AudioSegment
+from pydub.utils import mediainfo
+from record_store import RecordTable, SegmentTable, GrowingIntervalIndex, PathIndex, file_key
 import tempfile
+from urllib.parse import quote
+
+# Optional: watch the audio directory for changes instead of rescanning on demand
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+
+# Optional: brotli compression for large JSON responses (gzip is always available)
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__)
 CORS(app)
@@ -13,15 +55,178 @@ CORS(app)
 # Global variables for playlist management
 current_directory = None
 current_playlist = [] # Stores full paths on server
-audio_file_map = {}  # Maps filename to full path for nested directories
+audio_index = PathIndex(None, [])  # Resolves file names, stems and relative paths to full paths
+audio_metadata = {}  # Maps full path to (duration, sample_rate, channels) from the catalog
 SUPPORTED_AUDIO_EXTENSIONS = ('.mp3', '.wav', '.ogg')
 
-# Global variable to store parsed log data
-parsed_transcription_data = {}
+# Global variable to store parsed log data (a column store, see record_store.py)
+parsed_transcription_data = SegmentTable().finish()
 
 # Global variables for CSV error labeling
-csv_error_data = []
+csv_error_data = RecordTable().finish()
 csv_file_loaded = False
+LABELS_FILE = os.environ.get('LABELS_FILE', "/opt/data/labeled-segments.csv")
+LABEL_REQUIRED_FIELDS = ['record_id', 'start_time', 'end_time', 'audio_file']
+LABEL_FIELDNAMES = ['record_id', 'audio_file', 'error_phrase', 'start_time', 'end_time', 'duration', 'labeled_at']
+
+# Label store: one writer thread per worker group-commits queued labels under a file lock
+LABEL_COMMIT_WINDOW = 0.005  # seconds to wait for more labels before committing a batch
+LABEL_COMMIT_MAX_BATCH = 500
+label_queue = queue.Queue()
+label_writer_pid = None
+label_writer_lock = threading.Lock()
+# Incrementally read copy of the labels file: rows plus an index by record id
+labels_cache = {'file_id': None, 'offset': 0, 'fieldnames': None, 'rows': [], 'by_record': {}}
+labels_cache_lock = threading.Lock()
+# Interval index over labels_cache rows: (rows list, row count, audio index, GrowingIntervalIndex).
+# New labels are appended to it; it's rebuilt when the labels file or the audio directory changes
+LABEL_INDEX_MERGE_AFTER = 1024  # appended labels searched separately before merging them into the index
+label_intervals_cache = (None, 0, None, None)
+# The transcription log keyed by the audio file each of its file names resolves to:
+# (log data, audio index, {audio key: [log file names]}, IntervalIndex); see resolved_segments()
+resolved_segments_cache = (None, None, {}, None)
+resolved_segments_lock = threading.Lock()
+
+# Prefetch of upcoming error records; a client's new request supersedes (cancels) its previous
+# one, in every worker. Clients are told apart by a client_id in the request or a cookie.
+PREFETCH_DEFAULT_COUNT = 3
+PREFETCH_MAX_COUNT = 10
+PREFETCH_CLIENT_COOKIE = 'prefetch_client'
+PREFETCH_CLIENT_TTL = 24 * 3600  # seconds before an idle client's entry is dropped
+prefetch_executor = ThreadPoolExecutor(max_workers=2)
+prefetch_tokens = {}  # client id -> token of its latest request handled by this worker
+prefetch_futures = {}  # client id -> queued or running work of that request
+prefetch_lock = threading.Lock()
+
+# Bulk export of labeled segments as sharded tar archives
+EXPORT_DIR = os.path.join(os.path.dirname(LABELS_FILE), 'export')
+EXPORT_SHARD_SIZE = 50  # source files per archive
+EXPORT_WORKERS = os.cpu_count() or 2
+
+# Page sizes for the paginated queries
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# On-disk cache for data derived from audio files (waveform peaks, ...)
+CACHE_DIR = os.environ.get('AUDIO_CACHE_DIR', '/opt/data/cache')
+PEAKS_CACHE_DIR = os.path.join(CACHE_DIR, 'peaks')
+# Finest zoom level stores one min/max pair per 256 samples; each coarser
+# level merges 4 pairs of the level below it.
+PEAKS_BASE_SAMPLES_PER_PEAK = 256
+PEAKS_LEVEL_FACTOR = 4
+PEAKS_LEVEL_COUNT = 5
+PEAKS_DEFAULT_MAX_PEAKS = 20000
+# Files are decoded and reduced this many finest-level peaks at a time (about 1M frames)
+PEAKS_CHUNK_PEAKS = 4096
+
+# Background peak generation for files in the loaded directory
+peaks_executor = ThreadPoolExecutor(max_workers=2)
+peaks_pending = set()
+peaks_lock = threading.Lock()
+
+# Optional low-bitrate proxies of the originals, transcoded in the background
+PROXY_ENABLED = os.environ.get('AUDIO_PROXIES', '0') == '1'
+PROXY_DIR = os.path.join(CACHE_DIR, 'proxies')
+PROXY_FORMATS = {
+    'opus': {'ext': 'ogg', 'mimetype': 'audio/ogg', 'codec': ['-c:a', 'libopus', '-b:a', '32k']},
+    'mp3': {'ext': 'mp3', 'mimetype': 'audio/mpeg', 'codec': ['-c:a', 'libmp3lame', '-b:a', '64k']},
+}
+# Proxy served to clients that don't explicitly accept any proxy type (e.g. Accept: */*)
+PROXY_DEFAULT_FORMAT = os.environ.get('AUDIO_PROXY_DEFAULT', 'mp3')
+PROXY_RETRY_AFTER = 5  # seconds; a proxy requested explicitly is still being transcoded
+proxy_executor = ThreadPoolExecutor(max_workers=2)
+proxy_pending = set()
+proxy_lock = threading.Lock()
+
+# Content-addressed cache of extracted segments, shared by all gunicorn workers
+SEGMENT_CACHE_DIR = os.path.join(CACHE_DIR, 'segments')
+SEGMENT_CACHE_DB = os.path.join(SEGMENT_CACHE_DIR, 'index.sqlite')
+SEGMENT_CACHE_MAX_BYTES = int(os.environ.get('SEGMENT_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+segment_cache_ready = False
+
+# Bounded per-worker pool for on-demand decoding; once DECODE_QUEUE_LIMIT requests are
+# waiting for it, further ones are turned away with 503 + Retry-After instead of piling up
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', os.cpu_count() or 2))
+DECODE_QUEUE_LIMIT = int(os.environ.get('DECODE_QUEUE_LIMIT', 16))
+DECODE_RETRY_AFTER = 2  # seconds
+decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS)
+decode_slots = threading.BoundedSemaphore(DECODE_WORKERS + DECODE_QUEUE_LIMIT)
+
+# Batch APIs: request size limits, and how far apart two windows of one file may be
+# and still be cut from a single decode, which is capped in length to bound its memory
+BATCH_MAX_LABELS = 5000
+BATCH_MAX_SEGMENTS = 1000
+BATCH_SPAN_GAP = 60.0  # seconds
+BATCH_MAX_SPAN = 300.0  # seconds; about 50 MB of 44.1 kHz stereo PCM
+
+# Persistent catalog of audio files, rescanned incrementally by directory mtime
+CATALOG_DB = os.path.join(CACHE_DIR, 'catalog.sqlite')
+CATALOG_WATCH = os.environ.get('CATALOG_WATCH', '0') == '1'
+catalog_ready = False
+catalog_observer = None
+CATALOG_COMMIT_SECONDS = 0.2  # a scan commits at least this often so requests aren't blocked on it
+catalog_writer = ThreadPoolExecutor(max_workers=1)  # metadata found while serving requests is stored here
+METADATA_WORKERS = os.cpu_count() or 2
+
+# Suggested speech boundaries around each error record, from frame energy and zero crossings
+BOUNDARY_DB = os.path.join(CACHE_DIR, 'boundaries.sqlite')
+BOUNDARY_VERSION = 1  # bump when the detector changes so cached suggestions are recomputed
+BOUNDARY_FRAME = 0.025  # seconds per analysis frame
+BOUNDARY_HOP = 0.010  # seconds between frames
+BOUNDARY_MIN_GAP = 0.2  # pauses shorter than this don't split speech
+BOUNDARY_MIN_SPEECH = 0.1  # shorter bursts are treated as noise
+BOUNDARY_PADDING = 0.05  # added on both sides of the detected speech
+BOUNDARY_WORKERS = os.cpu_count() or 2
+boundary_ready = False
+
+# Loaded data shared by all gunicorn workers; each worker reloads a key when its version changes
+STATE_DB = os.path.join(CACHE_DIR, 'state.sqlite')
+state_ready = False
+state_versions = {}
+
+# Serialized (and compressed) bodies of the large polling endpoints, kept per data version
+RESPONSE_COMPRESS_MIN_BYTES = 1024
+response_cache = {}
+response_cache_lock = threading.Lock()
+
+# Startup loading: one worker per server loads the default data in a background thread
+STARTUP_AUDIO_DIR = os.environ.get('STARTUP_AUDIO_DIR', "/opt/audio")
+# The first of these that exists is loaded
+STARTUP_CSV_PATHS = os.environ.get('STARTUP_CSV_PATHS',
+                                   "/opt/data/err-dataset-orig.csv:/opt/data/err-dataset.csv").split(os.pathsep)
+SNAPSHOT_DIR = os.path.join(CACHE_DIR, 'snapshots')
+SNAPSHOT_FORMAT = 2  # bump when the pickled data structures change
+startup_status = {'ready': False, 'message': "Starting up"}
+startup_lock_file = None
+startup_attempted = False  # whether this process has tried to take the startup lock
+
+# Streaming parser settings for CSV error data and transcription logs
+PARSE_CHUNK_SIZE = 1024 * 1024
+PARSE_PROGRESS_ROWS = 50000
+
+# Request and stage metrics; each worker writes its own snapshot file and /metrics sums them.
+# Snapshots are kept per server run (METRICS_RUN_ID, set when the server starts), so counters
+# start from zero with each run; those of exited workers are folded into totals.json.
+METRICS_DIR = os.path.join(CACHE_DIR, 'metrics')
+METRICS_TOTALS = 'totals.json'
+METRICS_FLUSH_INTERVAL = 1.0  # seconds between snapshot writes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+METRIC_HELP = {
+    'http_requests_total': ('counter', 'Requests handled, by route, method and status'),
+    'http_request_duration_seconds': ('histogram', 'Time to produce the response, by route'),
+    'http_request_size_bytes': ('histogram', 'Request body size, by route'),
+    'http_response_size_bytes': ('histogram', 'Response body size, by route'),
+    'stage_duration_seconds': ('histogram', 'Time spent in internal stages (decode, walk, parse, label write)'),
+}
+metrics = {}
+metrics_lock = threading.Lock()
+metrics_flushed_at = 0.0
+metrics_process = None  # snapshot file name of this process: pid plus a random suffix
+# Optional slow-request log: a sampled fraction of requests is profiled and kept if slow
+SLOW_REQUEST_SECONDS = float(os.environ.get('SLOW_REQUEST_SECONDS', '0'))  # 0 disables it
+SLOW_REQUEST_SAMPLE_RATE = float(os.environ.get('SLOW_REQUEST_SAMPLE_RATE', '0.1'))
+SLOW_REQUEST_DIR = os.path.join(CACHE_DIR, 'slow-requests')
 
 def time_to_seconds(time_str):
     """Convert HH:MM:SS format to seconds"""
@@ -38,19 +243,51 @@ def time_to_seconds(time_str):
     except (ValueError, AttributeError):
         return 0.0
 
-def parse_log_content(log_content):
+class ProgressReader(io.RawIOBase):
+    """Binary stream wrapper that counts the bytes read so far, for progress reporting"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.raw.read(len(buffer))
+        buffer[:len(data)] = data
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def open_text_stream(raw):
+    """
+    Wraps a binary file or upload stream so it is decoded in PARSE_CHUNK_SIZE chunks.
+    Returns (progress_reader, text_stream).
+    """
+    progress = ProgressReader(raw)
+    text = io.TextIOWrapper(io.BufferedReader(progress, PARSE_CHUNK_SIZE), encoding='utf-8', newline='')
+    return progress, text
+
+
+def sniff_delimiter(header_line):
+    """Use tab if the header has more tabs than commas, else comma"""
+    return '\t' if header_line.count('\t') > header_line.count(',') else ','
+
+
+def parse_log_stream(text_stream, on_progress=None):
     """
-    Parses the log content to extract error segments for each audio file.
+    Parses a transcription log from a text stream to extract error segments for each audio file.
     Only supports the new CSV/TSV format as in sample_log.txt.
-    Returns a dict mapping audio file basenames to a list of error segments.
-    """
-    data = {}
-    # Auto-detect delimiter: use tab if more tabs than commas, else comma
-    tab_count = log_content.count('\t')
-    comma_count = log_content.count(',')
-    delimiter = '\t' if tab_count > comma_count else ','
-    reader = csv.reader(StringIO(log_content), delimiter=delimiter)
-    header = next(reader, None)
+    Rows are read incrementally; on_progress(rows) is called every PARSE_PROGRESS_ROWS rows.
+    Returns a SegmentTable of error segments keyed by the audio file path as the log records it
+    (resolved to a file in the audio directory by audio_key).
+    """
+    data = SegmentTable()
+    header_line = text_stream.readline()
+    delimiter = sniff_delimiter(header_line)
+    header = next(csv.reader([header_line], delimiter=delimiter), None) or []
+    reader = csv.reader(text_stream, delimiter=delimiter)
     # Find relevant column indices
     def col(name):
         try:
@@ -64,11 +301,13 @@ def parse_log_content(log_content):
     col_short_error = col('shortFormError')
     col_short_start = col('shortFormStart')
     col_short_end = col('shortFormEnd')
-    for row in reader:
-        if not row or len(row) <= max(filter(None, [col_audio, col_long_start, col_long_end, col_long_error, col_short_error, col_short_start, col_short_end])):
+    max_col = max(filter(None, [col_audio, col_long_start, col_long_end, col_long_error, col_short_error, col_short_start, col_short_end]), default=0)
+    for row_number, row in enumerate(reader, 1):
+        if on_progress and row_number % PARSE_PROGRESS_ROWS == 0:
+            on_progress(row_number)
+        if not row or len(row) <= max_col:
             continue
         audio_path = row[col_audio]
-        filename = os.path.basename(audio_path)
         try:
             long_start = float(row[col_long_start]) if col_long_start is not None else None
             long_end = float(row[col_long_end]) if col_long_end is not None else None
@@ -84,67 +323,1987 @@ def parse_log_content(log_content):
             'shortFormStart': short_start,
             'shortFormEnd': short_end
         }
-        if filename not in data:
-            data[filename] = []
-        data[filename].append(segment)
-    return data
+        data.append(audio_path, segment)
+    return data.finish()
+
+
+def parse_log_content(log_content):
+    """Parses log content that is already in memory (see parse_log_stream)"""
+    return parse_log_stream(StringIO(log_content))
+
+
+def iter_csv_records(text_stream, on_progress=None):
+    """
+    Yields error records from a CSV error data stream, one row at a time.
+    Rows without a filename or with an invalid time are skipped.
+    """
+    reader = csv.DictReader(text_stream)
+    skipped = 0
+    for row_number, row in enumerate(reader, 1):
+        if on_progress and row_number % PARSE_PROGRESS_ROWS == 0:
+            on_progress(row_number)
+        # Map actual CSV columns to expected format
+        if all(col in row for col in ['recordErrorID', 'recordFile', 'exampleExample', 'recordTime']):
+            try:
+                record_time = time_to_seconds(row['recordTime']) if row['recordTime'].strip() else 0.0
+                record_file = row['recordFile'].strip()
+            except (ValueError, AttributeError):
+                skipped += 1
+                continue  # Skip rows with invalid time values
+            # Skip rows with empty filenames
+            if not record_file:
+                skipped += 1
+                continue
+            yield {
+                'record_id': row['recordErrorID'],
+                'record_file': record_file,
+                'example_phrase': row['exampleExample'],
+                'record_time': record_time
+            }
+    if skipped:
+        app.logger.warning(f"Skipped {skipped} CSV rows with empty filenames or invalid times")
+
+
+def resolve_audio_path(filename):
+    """
+    Resolves a filename from the client (or the CSV) to a full path on the server.
+    Accepts a relative path, a file name or a name without extension.
+    Returns None if the file cannot be found.
+    """
+    audio_path = audio_index.resolve(filename)
+    if audio_path:
+        return audio_path
+    # Files added since the last scan aren't indexed yet; look for them inside the directory only
+    relative = audio_index.relative(filename)
+    if current_directory and relative:
+        audio_path = os.path.join(current_directory, relative)
+        if os.path.isfile(audio_path):
+            return audio_path
+    return None
+
+
+def audio_key(name):
+    """
+    Identifies the audio file a client, CSV, log or label file name refers to: its full path,
+    or for names not found in the directory, the name without directory or extension.
+    Paths recorded on another machine (e.g. in the log) match by their longest trailing part.
+    """
+    return resolve_audio_path(name) or audio_index.resolve_suffix(name) or file_key(name)
+
+
+def resolved_segments():
+    """
+    Returns ({audio key: [log file names]}, IntervalIndex) for the loaded transcription log,
+    with log file names resolved through the audio directory, so same-named files in
+    different subdirectories don't share error segments, while one file logged under
+    several names (e.g. "/m1/x.wav" and "x.wav") gets the segments of all of them.
+    Rebuilt when either changes.
+    """
+    global resolved_segments_cache
+    with resolved_segments_lock:
+        data, index, names, intervals = resolved_segments_cache
+        if data is not parsed_transcription_data or index is not audio_index:
+            data, index = parsed_transcription_data, audio_index
+            names = {}
+            for name in data.files.names:
+                names.setdefault(audio_key(name), []).append(name)
+            intervals = data.interval_index(audio_key)
+            resolved_segments_cache = (data, index, names, intervals)
+        return names, intervals
+
+
+def log_file_names(filename):
+    """The transcription log's names for the audio file `filename` refers to, in log order"""
+    names, _ = resolved_segments()
+    return names.get(audio_key(filename), [])
+
+
+def file_error_segments(f_path):
+    """The transcription error segments of an audio file, under all of its log names"""
+    return [segment for name in log_file_names(f_path)
+            for segment in parsed_transcription_data.get(name, [])]
+
+
+def match_record_files():
+    """
+    Matches the loaded CSV's record files against the audio directory.
+    Returns (missing, ambiguous): names that match no file, and names that match several.
+    """
+    missing, ambiguous = [], []
+    if not current_directory:
+        return missing, ambiguous
+    for name in csv_error_data.files.names:
+        count = len(audio_index.candidates(name))
+        if count == 0:
+            missing.append(name)
+        elif count > 1:
+            ambiguous.append(name)
+    return missing, ambiguous
+
+
+def report_record_file_matches():
+    """Logs CSV record files that can't be resolved to exactly one audio file"""
+    missing, ambiguous = match_record_files()
+    if missing:
+        app.logger.warning(f"{len(missing)} CSV record files not found in {current_directory}, e.g. {missing[0]}")
+    if ambiguous:
+        app.logger.warning(f"{len(ambiguous)} CSV record files match several audio files, e.g. {ambiguous[0]}"
+                           f" (using the top-level or first match)")
+    return missing, ambiguous
+
+
+def unmatched_message(missing, ambiguous):
+    """Suffix for load messages about record files that don't resolve to exactly one audio file"""
+    notes = []
+    if missing:
+        notes.append(f"{len(missing)} record files not found in the audio directory")
+    if ambiguous:
+        notes.append(f"{len(ambiguous)} record files match several audio files")
+    return f" ({'; '.join(notes)})" if notes else ""
+
+
+# Metrics
+
+def observe(name, labels, value, buckets):
+    """Adds one observation to a histogram; labels is a tuple of (name, value) pairs"""
+    with metrics_lock:
+        series = metrics.setdefault(name, {}).setdefault(labels, {'buckets': [0] * len(buckets), 'sum': 0.0, 'count': 0})
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                series['buckets'][i] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+
+def increment(name, labels):
+    with metrics_lock:
+        series = metrics.setdefault(name, {})
+        series[labels] = series.get(labels, 0) + 1
+
+
+def observe_stage(stage, started):
+    """Records the time since `started` (a time.perf_counter() value) for an internal stage"""
+    observe('stage_duration_seconds', (('stage', stage),), time.perf_counter() - started, LATENCY_BUCKETS)
+
+
+def server_run_id():
+    """
+    Id of the current server run. gunicorn's on_starting hook and `python app.py` set
+    METRICS_RUN_ID; other launchers fall back to the parent process, which is the gunicorn
+    master for its workers.
+    """
+    return os.environ.get('METRICS_RUN_ID') or f'ppid-{os.getppid()}'
+
+
+def metrics_run_dir():
+    """Snapshot directory of the current server run"""
+    return os.path.join(METRICS_DIR, server_run_id())
+
+
+def reset_metrics(run_id):
+    """Starts a new server run: removes the snapshots of earlier runs and sets METRICS_RUN_ID"""
+    if os.path.isdir(METRICS_DIR):
+        shutil.rmtree(METRICS_DIR, ignore_errors=True)
+    os.environ['METRICS_RUN_ID'] = str(run_id)
+
+
+def write_json_atomic(path, value):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f)
+    os.replace(path + '.tmp', path)
+
+
+def flush_metrics():
+    """Writes this worker's counters to its snapshot file"""
+    global metrics_flushed_at, metrics_process
+    with metrics_lock:
+        snapshot = {name: [[list(labels), value] for labels, value in series.items()]
+                    for name, series in metrics.items()}
+        metrics_flushed_at = time.monotonic()
+    # The random suffix keeps a new process with a reused pid from overwriting a dead one's totals
+    if metrics_process is None or not metrics_process.startswith(f'{os.getpid()}-'):
+        metrics_process = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+    run_dir = metrics_run_dir()
+    os.makedirs(run_dir, exist_ok=True)
+    write_json_atomic(os.path.join(run_dir, metrics_process + '.json'), snapshot)
+
+
+def merge_snapshot(totals, snapshot):
+    """Adds a snapshot ({name: [[labels, value], ...]}) to summed totals ({name: {labels: value}})"""
+    for name, series in snapshot.items():
+        merged = totals.setdefault(name, {})
+        for labels, value in series:
+            labels = tuple(tuple(pair) for pair in labels)
+            if isinstance(value, dict):
+                current = merged.setdefault(labels, {'buckets': [0] * len(value['buckets']), 'sum': 0.0, 'count': 0})
+                current['buckets'] = [a + b for a, b in zip(current['buckets'], value['buckets'])]
+                current['sum'] += value['sum']
+                current['count'] += value['count']
+            else:
+                merged[labels] = merged.get(labels, 0) + value
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def read_snapshot(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def collect_metrics():
+    """
+    Sums the snapshot files of this run's workers. Snapshots of exited workers are
+    folded into totals.json first, so counters don't go backwards when gunicorn
+    replaces a worker and the directory doesn't grow with every replacement.
+    """
+    run_dir = metrics_run_dir()
+    os.makedirs(run_dir, exist_ok=True)
+    totals_path = os.path.join(run_dir, METRICS_TOTALS)
+    with open(os.path.join(run_dir, '.lock'), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        totals = {}
+        merge_snapshot(totals, read_snapshot(totals_path) or {})
+        live, folded = [], []
+        for entry in os.scandir(run_dir):
+            pid = entry.name.split('-', 1)[0]
+            if not (entry.name.endswith('.json') and pid.isdigit()):
+                continue
+            snapshot = read_snapshot(entry.path)
+            if snapshot is None:
+                continue
+            if process_alive(int(pid)):
+                live.append(snapshot)
+            else:
+                merge_snapshot(totals, snapshot)
+                folded.append(entry.path)
+        if folded:
+            write_json_atomic(totals_path, {name: [[list(labels), value] for labels, value in series.items()]
+                                            for name, series in totals.items()})
+            for path in folded:
+                os.remove(path)
+    for snapshot in live:
+        merge_snapshot(totals, snapshot)
+    return totals
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + '}'
+
+
+def render_metrics(totals):
+    """Formats summed metrics in the Prometheus text exposition format"""
+    lines = []
+    for name, (kind, help_text) in METRIC_HELP.items():
+        series = totals.get(name)
+        if not series:
+            continue
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(series.items()):
+            if kind == 'counter':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+            buckets = SIZE_BUCKETS if name.endswith('_bytes') else LATENCY_BUCKETS
+            for bound, count in zip(buckets, value['buckets']):
+                lines.append(f'{name}_bucket{format_labels(labels, [("le", bound)])} {count}')
+            lines.append(f'{name}_bucket{format_labels(labels, [("le", "+Inf")])} {value["count"]}')
+            lines.append(f'{name}_sum{format_labels(labels)} {value["sum"]}')
+            lines.append(f'{name}_count{format_labels(labels)} {value["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+@app.before_request
+def start_request_timer():
+    request.environ['metrics.started'] = time.perf_counter()
+    if SLOW_REQUEST_SECONDS and random.random() < SLOW_REQUEST_SAMPLE_RATE:
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another request on this worker is already being profiled
+            return
+        request.environ['metrics.profiler'] = profiler
+
+
+@app.after_request
+def record_request_metrics(response):
+    started = request.environ.get('metrics.started')
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    labels = (('route', route),)
+    observe('http_request_duration_seconds', labels, elapsed, LATENCY_BUCKETS)
+    observe('http_request_size_bytes', labels, request.content_length or 0, SIZE_BUCKETS)
+    observe('http_response_size_bytes', labels, response.content_length or 0, SIZE_BUCKETS)
+    increment('http_requests_total', labels + (('method', request.method), ('status', str(response.status_code))))
+    profiler = request.environ.pop('metrics.profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        if elapsed >= SLOW_REQUEST_SECONDS:
+            write_slow_request_profile(profiler, route, elapsed)
+    if time.monotonic() - metrics_flushed_at >= METRICS_FLUSH_INTERVAL:
+        try:
+            flush_metrics()
+        except OSError as e:
+            app.logger.warning(f"Could not write metrics snapshot: {e}")
+    return response
+
+
+def write_slow_request_profile(profiler, route, elapsed):
+    """Saves the top of a slow request's profile, sorted by cumulative time"""
+    os.makedirs(SLOW_REQUEST_DIR, exist_ok=True)
+    name = f"{datetime.datetime.now().strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{re.sub(r'[^A-Za-z0-9]+', '_', route).strip('_') or 'root'}.txt"
+    out = StringIO()
+    out.write(f"{request.method} {request.full_path} took {elapsed:.3f}s\n\n")
+    pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(40)
+    with open(os.path.join(SLOW_REQUEST_DIR, name), 'w') as f:
+        f.write(out.getvalue())
+    app.logger.warning(f"Slow request {request.method} {request.path} took {elapsed:.3f}s; profile saved to {name}")
+
+
+@app.route('/metrics')
+def serve_metrics():
+    """Prometheus metrics summed over all workers"""
+    flush_metrics()
+    return render_metrics(collect_metrics()), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# Conditional and compressed JSON responses
+
+def response_encoding():
+    """Picks brotli or gzip from the Accept-Encoding header, or None"""
+    if brotli is not None and request.accept_encodings['br']:
+        return 'br'
+    if request.accept_encodings['gzip']:
+        return 'gzip'
+    return None
+
+
+def versioned_json(name, version, build):
+    """
+    Serves build() as JSON with an ETag derived from the version of the data it shows.
+    A matching If-None-Match gets 304 without building anything, and the serialized and
+    compressed bodies are kept until the version changes, so repeated polls of unchanged
+    data cost neither serialization nor compression. Each content coding gets its own
+    strong ETag (the version's tag plus e.g. "-gzip").
+    """
+    etag = hashlib.sha1(f"{name}:{version!r}".encode('utf-8')).hexdigest()[:20]
+    cached_etag = next((tag for tag in (etag, f"{etag}-gzip", f"{etag}-br") if request.if_none_match.contains(tag)),
+                       None)
+    if cached_etag:
+        response = app.response_class(status=304)
+        response.set_etag(cached_etag)
+    else:
+        with response_cache_lock:
+            entry = response_cache.get(name)
+        if entry is None or entry['etag'] != etag:
+            entry = {'etag': etag, 'identity': f"{app.json.dumps(build())}\n".encode('utf-8')}
+            with response_cache_lock:
+                response_cache[name] = entry
+        encoding = response_encoding() if len(entry['identity']) >= RESPONSE_COMPRESS_MIN_BYTES else None
+        if encoding and encoding not in entry:
+            if encoding == 'br':
+                entry[encoding] = brotli.compress(entry['identity'], quality=5)
+            else:
+                entry[encoding] = gzip.compress(entry['identity'], compresslevel=6)
+        response = app.response_class(entry[encoding] if encoding else entry['identity'], mimetype='application/json')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.set_etag(f"{etag}-{encoding}" if encoding else etag)
+    response.vary.add('Accept-Encoding')
+    # Let browsers keep the body but revalidate it on every request
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+# Waveform peaks
+
+def peaks_cache_path(audio_path):
+    """Return the peaks cache file for an audio file, keyed by its path and mtime"""
+    st = os.stat(audio_path)
+    key = f"{os.path.realpath(audio_path)}:{st.st_mtime_ns}:{st.st_size}"
+    return os.path.join(PEAKS_CACHE_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+
+def pcm_to_float(pcm, channels, sample_width):
+    """Converts interleaved little-endian PCM to a (frames, channels) float32 array in [-1, 1]"""
+    frame_size = channels * sample_width
+    data = np.frombuffer(pcm, dtype=np.uint8, count=len(pcm) - len(pcm) % frame_size)
+    if sample_width == 1:
+        samples = data.astype(np.float32) - 128
+    elif sample_width == 3:
+        triples = data.reshape(-1, 3).astype(np.int32)
+        samples = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        samples = np.where(samples >= 1 << 23, samples - (1 << 24), samples).astype(np.float32)
+    else:
+        samples = data.view(f'<i{sample_width}').astype(np.float32)
+    samples /= float(1 << (8 * sample_width - 1))
+    return samples.reshape(-1, channels)
+
+
+def open_pcm_stream(audio_path, chunk_frames):
+    """
+    Decodes a whole audio file without holding it in memory: PCM WAV data is read
+    sequentially, other formats are streamed from an ffmpeg pipe.
+    Returns (sample_rate, channels, sample_width, chunks), where chunks yields PCM bytes of
+    chunk_frames frames each (the last one may be shorter).
+    """
+    info = get_audio_info(audio_path)
+    layout = info['wav_layout']
+    if layout:
+        def wav_chunks():
+            chunk_bytes = chunk_frames * layout['block_align']
+            remaining = layout['data_size']
+            with open(audio_path, 'rb') as f:
+                f.seek(layout['data_offset'])
+                while remaining > 0:
+                    chunk = f.read(min(chunk_bytes, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    yield chunk
+        return layout['sample_rate'], layout['channels'], layout['sample_width'], wav_chunks()
+
+    sample_rate = info['sample_rate'] or 44100
+    channels = info['channels'] or 1
+    command = [AudioSegment.converter, '-v', 'error', '-i', audio_path, '-vn', '-f', 's16le',
+               '-acodec', 'pcm_s16le', '-ac', str(channels), '-ar', str(sample_rate), '-']
+
+    def pipe_chunks():
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        try:
+            while True:
+                # A buffered read returns the full size until the end of the stream
+                chunk = process.stdout.read(chunk_frames * channels * 2)
+                if not chunk:
+                    break
+                yield chunk
+            errors = process.stderr.read()
+            if process.wait() != 0:
+                raise RuntimeError(errors.decode('utf-8', errors='replace').strip() or "ffmpeg failed")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+    return sample_rate, channels, 2, pipe_chunks()
+
+
+def block_peaks(samples):
+    """
+    Min/max of every PEAKS_BASE_SAMPLES_PER_PEAK frames (all channels) of a (frames, channels)
+    array, as an (n, 2) float32 array; a partial last block is padded with silence.
+    """
+    block = PEAKS_BASE_SAMPLES_PER_PEAK
+    n_blocks = max(1, -(-len(samples) // block))
+    if n_blocks * block != len(samples):
+        padded = np.zeros((n_blocks * block, samples.shape[1]), dtype=np.float32)
+        padded[:len(samples)] = samples
+        samples = padded
+    blocks = samples.reshape(n_blocks, block * samples.shape[1])
+    return np.stack([blocks.min(axis=1), blocks.max(axis=1)], axis=1)
+
+
+def compute_peaks_pyramid(level):
+    """
+    Computes the min/max peak levels from the finest level (see block_peaks).
+    Level 0 has one (min, max) pair per PEAKS_BASE_SAMPLES_PER_PEAK frames; each
+    following level merges PEAKS_LEVEL_FACTOR pairs of the previous one.
+    Returns a list of (n, 2) int16 arrays.
+    """
+    levels = [level]
+    for _ in range(PEAKS_LEVEL_COUNT - 1):
+        factor = PEAKS_LEVEL_FACTOR
+        n = -(-len(level) // factor)
+        # Pad by repeating the last pair so the padding never widens the range
+        padded = np.concatenate([level, np.repeat(level[-1:], n * factor - len(level), axis=0)])
+        grouped = padded.reshape(n, factor, 2)
+        level = np.stack([grouped[:, :, 0].min(axis=1), grouped[:, :, 1].max(axis=1)], axis=1)
+        levels.append(level)
+    return [np.round(np.clip(lvl, -1.0, 1.0) * 32767).astype(np.int16) for lvl in levels]
+
+
+def generate_peaks(audio_path):
+    """
+    Computes and stores the peaks pyramid for a file unless it is already cached.
+    The file is decoded and reduced chunk by chunk, so memory stays bounded for long recordings.
+    """
+    cache_path = peaks_cache_path(audio_path)
+    if os.path.exists(cache_path):
+        return cache_path
+    chunk_frames = PEAKS_BASE_SAMPLES_PER_PEAK * PEAKS_CHUNK_PEAKS
+    sample_rate, channels, sample_width, chunks = open_pcm_stream(audio_path, chunk_frames)
+    frames, finest = 0, []
+    for chunk in chunks:
+        samples = pcm_to_float(chunk, channels, sample_width)
+        frames += len(samples)
+        finest.append(block_peaks(samples))
+    levels = compute_peaks_pyramid(np.concatenate(finest) if finest else np.zeros((1, 2), dtype=np.float32))
+    os.makedirs(PEAKS_CACHE_DIR, exist_ok=True)
+    # Write to a temp file and rename so concurrent workers never see a partial file
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+    np.savez(tmp_path,
+             sample_rate=np.int64(sample_rate),
+             frames=np.int64(frames),
+             **{f'level_{i}': lvl for i, lvl in enumerate(levels)})
+    os.replace(tmp_path, cache_path)
+    return cache_path
+
+
+def _generate_peaks_in_background(audio_path):
+    try:
+        generate_peaks(audio_path)
+    except Exception as e:
+        app.logger.warning(f"Failed to generate peaks for {audio_path}: {e}")
+    finally:
+        with peaks_lock:
+            peaks_pending.discard(audio_path)
+
+
+def schedule_peaks_generation(audio_paths):
+    """Queues peak generation for every file that is not cached or already queued"""
+    for audio_path in audio_paths:
+        with peaks_lock:
+            if audio_path in peaks_pending:
+                continue
+            peaks_pending.add(audio_path)
+        peaks_executor.submit(_generate_peaks_in_background, audio_path)
+
+
+@app.route('/peaks/<path:filename>')
+def serve_peaks(filename):
+    """
+    Returns precomputed waveform peaks for an audio file so the browser can draw
+    the waveform without downloading and decoding the whole recording.
+    The finest zoom level with at most `max_peaks` pairs is returned, or a
+    specific level if `level` is given.
+    """
+    audio_path = resolve_audio_path(filename)
+    if not audio_path:
+        return jsonify({"success": False, "message": "File not found"}), 404
+
+    max_peaks = request.args.get('max_peaks', PEAKS_DEFAULT_MAX_PEAKS, type=int)
+    level_index = request.args.get('level', type=int)
+    try:
+        peaks_file = peaks_cache_path(audio_path)
+        if not os.path.exists(peaks_file):
+            peaks_file = run_decode(generate_peaks, audio_path)
+        with np.load(peaks_file) as cached:
+            sample_rate = int(cached['sample_rate'])
+            frames = int(cached['frames'])
+            if level_index is None:
+                level_index = PEAKS_LEVEL_COUNT - 1
+                for i in range(PEAKS_LEVEL_COUNT):
+                    if len(cached[f'level_{i}']) <= max_peaks:
+                        level_index = i
+                        break
+            level_index = min(max(level_index, 0), PEAKS_LEVEL_COUNT - 1)
+            level = cached[f'level_{level_index}']
+    except DecoderBusy:
+        return jsonify({"success": False, "message": "Server busy decoding audio, retry shortly"}), \
+            503, {'Retry-After': str(DECODE_RETRY_AFTER)}
+    except Exception as e:
+        app.logger.error(f"Error generating peaks for {audio_path}: {e}")
+        return jsonify({"success": False, "message": f"Error generating peaks: {str(e)}"}), 500
+
+    # WaveSurfer expects interleaved [max, min, max, min, ...] values in [-1, 1]
+    interleaved = np.round(level[:, ::-1].astype(np.float32).ravel() / 32767, 4)
+    return jsonify({
+        "success": True,
+        "sample_rate": sample_rate,
+        "duration": frames / sample_rate if sample_rate else 0.0,
+        "level": level_index,
+        "levels": PEAKS_LEVEL_COUNT,
+        "samples_per_peak": PEAKS_BASE_SAMPLES_PER_PEAK * PEAKS_LEVEL_FACTOR ** level_index,
+        "peaks": interleaved.tolist()
+    })
+
+
+# Streaming proxies
+
+def proxy_path(audio_path, fmt):
+    """Returns the proxy file for an audio file and format, keyed by its path and mtime"""
+    st = os.stat(audio_path)
+    key = f"{os.path.realpath(audio_path)}:{st.st_mtime_ns}:{st.st_size}:{fmt}"
+    return os.path.join(PROXY_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.' + PROXY_FORMATS[fmt]['ext'])
+
+
+def generate_proxy(audio_path, fmt):
+    """Transcodes an audio file to a low-bitrate proxy unless it already exists"""
+    target = proxy_path(audio_path, fmt)
+    if os.path.exists(target):
+        return target
+    os.makedirs(PROXY_DIR, exist_ok=True)
+    tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+    command = [AudioSegment.converter, '-v', 'error', '-y', '-i', audio_path, '-vn',
+               *PROXY_FORMATS[fmt]['codec'], '-f', 'ogg' if PROXY_FORMATS[fmt]['ext'] == 'ogg' else fmt, tmp_path]
+    result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip() or "ffmpeg failed")
+    os.replace(tmp_path, target)
+    return target
+
+
+def _generate_proxy_in_background(audio_path, fmt):
+    try:
+        generate_proxy(audio_path, fmt)
+    except Exception as e:
+        app.logger.warning(f"Failed to generate {fmt} proxy for {audio_path}: {e}")
+    finally:
+        with proxy_lock:
+            proxy_pending.discard((audio_path, fmt))
+
+
+def schedule_proxy_generation(audio_paths, formats=None):
+    """Queues proxy transcoding for files that are not already queued (no-op unless proxies are enabled)"""
+    if not PROXY_ENABLED:
+        return
+    for audio_path in audio_paths:
+        for fmt in formats or PROXY_FORMATS:
+            with proxy_lock:
+                if (audio_path, fmt) in proxy_pending:
+                    continue
+                proxy_pending.add((audio_path, fmt))
+            proxy_executor.submit(_generate_proxy_in_background, audio_path, fmt)
+
+
+def negotiate_audio_format():
+    """
+    Picks the proxy type the client explicitly accepts with the highest quality,
+    otherwise PROXY_DEFAULT_FORMAT.
+    """
+    best, best_quality = None, 0
+    for mimetype, quality in request.accept_mimetypes:
+        for fmt in PROXY_FORMATS:
+            if mimetype == PROXY_FORMATS[fmt]['mimetype'] and quality > best_quality:
+                best, best_quality = fmt, quality
+    return best or PROXY_DEFAULT_FORMAT
+
 
 @app.route('/audio_files/<path:filename>')
 def serve_audio_file(filename):
     """
     Serves audio files directly to the client's web browser.
-    Now supports nested directories using the audio_file_map.
-    """
-    # First check if we have a mapping for this filename (from nested directories)
-    if filename in audio_file_map:
-        file_path = audio_file_map[filename]
-        directory = os.path.dirname(file_path)
-        file_name = os.path.basename(file_path)
-        return send_from_directory(directory, file_name)
-    
-    # Fallback to old behavior for flat directory structure
-    elif current_directory and os.path.exists(os.path.join(current_directory, filename)):
-        return send_from_directory(current_directory, filename)
-    else:
+    The filename may be a relative path, so files with the same name in
+    different subdirectories can be told apart (see resolve_audio_path).
+    ?format=original, opus or mp3 selects the representation. Without it and with
+    proxies enabled, the client is redirected to the proxy it accepts (see
+    negotiate_audio_format) if that has been transcoded, else to the original. Each
+    URL thus always serves the same bytes, so a player range-fetching one never gets
+    offsets of the other. Range requests are supported for both.
+    """
+    file_path = resolve_audio_path(filename)
+    if not file_path:
         return "File not found", 404
+    fmt = request.args.get('format')
+    if fmt is None:
+        if not PROXY_ENABLED:
+            return send_from_directory(os.path.dirname(file_path), os.path.basename(file_path))
+        fmt = negotiate_audio_format()
+        if not os.path.exists(proxy_path(file_path, fmt)):
+            # Not transcoded yet: queue it and stay with the original for now
+            schedule_proxy_generation([file_path], [fmt])
+            fmt = 'original'
+        response = redirect(url_for('serve_audio_file', filename=filename, format=fmt))
+        response.vary.add('Accept')
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    if fmt == 'original':
+        return send_from_directory(os.path.dirname(file_path), os.path.basename(file_path))
+    if fmt not in PROXY_FORMATS:
+        return f"Unsupported format: {fmt}", 400
+    target = proxy_path(file_path, fmt)
+    if not os.path.exists(target):
+        if not PROXY_ENABLED:
+            return "Audio proxies are disabled", 404
+        schedule_proxy_generation([file_path], [fmt])
+        return "Proxy is being transcoded, retry shortly", 503, {'Retry-After': str(PROXY_RETRY_AFTER)}
+    return send_file(target, mimetype=PROXY_FORMATS[fmt]['mimetype'], conditional=True)
+
+# Audio metadata and segment extraction
+
+# Cached header information per file, keyed by path and invalidated on mtime/size change
+audio_info_cache = {}
+WAV_PCM_SUBFORMAT = b'\x01\x00\x00\x00\x00\x00\x10\x00\x80\x00\x00\xaa\x00\x38\x9b\x71'
+
+
+def read_wav_layout(audio_path):
+    """
+    Parses the RIFF chunks of a WAV file without reading the sample data.
+    Returns a dict with the format fields and the byte offset/size of the data chunk.
+    """
+    with open(audio_path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise ValueError("Not a RIFF/WAVE file")
+        layout = {}
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                raise ValueError("WAV file has no data chunk")
+            chunk_id, chunk_size = struct.unpack('<4sI', chunk_header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                format_tag, channels, sample_rate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+                if format_tag == 0xFFFE and len(fmt) >= 40:
+                    # WAVE_FORMAT_EXTENSIBLE: PCM is identified by the sub-format GUID
+                    format_tag = 1 if fmt[24:40] == WAV_PCM_SUBFORMAT else format_tag
+                layout.update(format_tag=format_tag, channels=channels, sample_rate=sample_rate,
+                              block_align=block_align, sample_width=(bits + 7) // 8)
+            elif chunk_id == b'data':
+                if 'format_tag' not in layout:
+                    raise ValueError("WAV data chunk precedes fmt chunk")
+                data_offset = f.tell()
+                # Streamed WAVs often carry a bogus data size, so trust the file size instead
+                available = os.fstat(f.fileno()).st_size - data_offset
+                layout.update(data_offset=data_offset, data_size=min(chunk_size, available))
+                return layout
+            else:
+                f.seek(chunk_size, os.SEEK_CUR)
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)  # Chunks are word aligned
+
+
+MP3_BITRATES = {
+    # (MPEG-1?, layer) -> kbps by bitrate index
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+MP3_SAMPLE_RATES = {3: [44100, 48000, 32000], 2: [22050, 24000, 16000], 0: [11025, 12000, 8000]}
+
+
+def probe_mp3(audio_path):
+    """
+    Reads duration, sample rate and channels from the first MP3 frame header.
+    Uses the frame count of a Xing/Info or VBRI header when present, otherwise
+    assumes constant bitrate and derives the duration from the file size.
+    """
+    with open(audio_path, 'rb') as f:
+        head = f.read(64 * 1024)
+        file_size = os.fstat(f.fileno()).st_size
+        f.seek(max(file_size - 128, 0))
+        has_id3v1 = f.read(3) == b'TAG'
+    audio_start = 0
+    if head[:3] == b'ID3' and len(head) >= 10:
+        tag_size = (head[6] << 21) | (head[7] << 14) | (head[8] << 7) | head[9]
+        audio_start = 10 + tag_size + (10 if head[5] & 0x10 else 0)
+        with open(audio_path, 'rb') as f:
+            f.seek(audio_start)
+            head = f.read(64 * 1024)
+    for pos in range(len(head) - 4):
+        if head[pos] != 0xFF or (head[pos + 1] & 0xE0) != 0xE0:
+            continue
+        version = (head[pos + 1] >> 3) & 0x03
+        layer = 4 - ((head[pos + 1] >> 1) & 0x03)
+        bitrate_index = head[pos + 2] >> 4
+        rate_index = (head[pos + 2] >> 2) & 0x03
+        if version == 1 or layer == 4 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        mpeg1 = version == 3
+        sample_rate = MP3_SAMPLE_RATES[version][rate_index]
+        channels = 1 if (head[pos + 3] >> 6) == 3 else 2
+        samples_per_frame = 384 if layer == 1 else (1152 if mpeg1 or layer == 2 else 576)
+        bitrate = MP3_BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+
+        frames = None
+        side_info = (32 if channels == 2 else 17) if mpeg1 else (17 if channels == 2 else 9)
+        xing = pos + 4 + side_info
+        if head[xing:xing + 4] in (b'Xing', b'Info') and struct.unpack('>I', head[xing + 4:xing + 8])[0] & 1:
+            frames = struct.unpack('>I', head[xing + 8:xing + 12])[0]
+        elif head[pos + 36:pos + 40] == b'VBRI':
+            frames = struct.unpack('>I', head[pos + 50:pos + 54])[0]
+        if frames is not None:
+            duration = frames * samples_per_frame / sample_rate
+        else:
+            audio_bytes = file_size - audio_start - pos - (128 if has_id3v1 else 0)
+            duration = audio_bytes * 8 / bitrate
+        return {'duration': duration, 'sample_rate': sample_rate, 'channels': channels}
+    raise ValueError("No MPEG audio frame header found")
+
+
+def probe_ogg(audio_path):
+    """
+    Reads sample rate and channels from the Vorbis or Opus identification header
+    and the duration from the granule position of the last Ogg page.
+    """
+    with open(audio_path, 'rb') as f:
+        head = f.read(4096)
+        file_size = os.fstat(f.fileno()).st_size
+        f.seek(max(file_size - 65536, 0))
+        tail = f.read()
+    if head[:4] != b'OggS':
+        raise ValueError("Not an Ogg file")
+    packet = head[27 + head[26]:]
+    if packet[:7] == b'\x01vorbis':
+        channels, sample_rate = struct.unpack('<BI', packet[11:16])
+        granule_rate, pre_skip = sample_rate, 0
+    elif packet[:8] == b'OpusHead':
+        channels, pre_skip = struct.unpack('<BH', packet[9:12])
+        # Opus granule positions always count 48 kHz samples, which is also what it decodes to
+        sample_rate = granule_rate = 48000
+    else:
+        raise ValueError("Unsupported Ogg codec")
+    last_page = tail.rfind(b'OggS')
+    if last_page < 0:
+        raise ValueError("No Ogg page found at end of file")
+    granule = struct.unpack('<q', tail[last_page + 6:last_page + 14])[0]
+    return {'duration': max(granule - pre_skip, 0) / granule_rate, 'sample_rate': sample_rate, 'channels': channels}
+
+
+def probe_audio_header(audio_path):
+    """Reads duration, sample rate and channels from file headers, without decoding"""
+    lower = audio_path.lower()
+    if lower.endswith('.wav'):
+        layout = read_wav_layout(audio_path)
+        duration = None
+        if layout['block_align'] and layout['sample_rate']:
+            duration = layout['data_size'] / layout['block_align'] / layout['sample_rate']
+        return {'duration': duration, 'sample_rate': layout['sample_rate'], 'channels': layout['channels'],
+                'wav_layout': layout if layout['format_tag'] == 1 else None}
+    if lower.endswith('.mp3'):
+        return probe_mp3(audio_path)
+    if lower.endswith('.ogg'):
+        return probe_ogg(audio_path)
+    raise ValueError(f"Unsupported audio format: {audio_path}")
+
+
+def get_audio_info(audio_path):
+    """
+    Returns duration (seconds), sample rate and channel count for an audio file.
+    Only file headers are read (ffprobe is the fallback for headers we can't parse);
+    results are cached until the file changes.
+    """
+    st = os.stat(audio_path)
+    cached = audio_info_cache.get(audio_path)
+    if cached and cached[0] == (st.st_mtime_ns, st.st_size):
+        return cached[1]
+
+    info = {'duration': None, 'sample_rate': None, 'channels': None, 'wav_layout': None}
+    try:
+        info.update(probe_audio_header(audio_path))
+    except (ValueError, struct.error) as e:
+        app.logger.warning(f"Could not parse header of {audio_path}: {e}")
+    if info['duration'] is None:
+        probed = mediainfo(audio_path)
+        try:
+            info.update(duration=float(probed['duration']),
+                        sample_rate=int(probed['sample_rate']),
+                        channels=int(probed['channels']))
+        except (KeyError, ValueError):
+            pass
+    audio_info_cache[audio_path] = ((st.st_mtime_ns, st.st_size), info)
+    # Stored in the background: a scan in another worker may hold the catalog's write lock
+    catalog_writer.submit(catalog_record_info, audio_path, st, info)
+    return info
+
+
+def read_segment_pcm(audio_path, start, end):
+    """
+    Decodes only the [start, end] window (in seconds) of an audio file.
+    PCM WAV files are sliced straight out of a memory map of the data chunk;
+    other formats are seeked by ffmpeg before decoding.
+    Returns (pcm_bytes, sample_rate, channels, sample_width).
+    """
+    info = get_audio_info(audio_path)
+    layout = info['wav_layout']
+    if layout:
+        block_align = layout['block_align']
+        first = int(start * layout['sample_rate']) * block_align
+        last = int(end * layout['sample_rate']) * block_align
+        first = min(max(first, 0), layout['data_size'])
+        last = min(max(last, first), layout['data_size'])
+        with open(audio_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pcm = mm[layout['data_offset'] + first:layout['data_offset'] + last]
+        return pcm, layout['sample_rate'], layout['channels'], layout['sample_width']
+
+    sample_rate = info['sample_rate'] or 44100
+    channels = info['channels'] or 1
+    # -ss before -i makes ffmpeg seek in the input instead of decoding up to the offset
+    command = [AudioSegment.converter, '-v', 'error', '-ss', f'{max(start, 0):.3f}', '-i', audio_path,
+               '-t', f'{max(end - start, 0):.3f}', '-vn', '-f', 's16le', '-acodec', 'pcm_s16le',
+               '-ac', str(channels), '-ar', str(sample_rate), '-']
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip() or "ffmpeg failed")
+    return result.stdout, sample_rate, channels, 2
+
+
+def pcm_to_wav_bytes(pcm, sample_rate, channels, sample_width):
+    """Wraps raw PCM data in a WAV container"""
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav_out:
+        wav_out.setnchannels(channels)
+        wav_out.setsampwidth(sample_width)
+        wav_out.setframerate(sample_rate)
+        wav_out.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def connect_db(db_path):
+    """Opens a SQLite database that can be shared safely between worker processes"""
+    os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def segment_cache_db():
+    """Returns a connection to the segment cache index, creating the schema on first use"""
+    global segment_cache_ready
+    conn = connect_db(SEGMENT_CACHE_DB)
+    if not segment_cache_ready:
+        conn.execute('CREATE TABLE IF NOT EXISTS segments '
+                     '(key TEXT PRIMARY KEY, size INTEGER NOT NULL, last_access REAL NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS segments_lru ON segments (last_access)')
+        conn.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+        segment_cache_ready = True
+    return conn
+
+
+def segment_cache_key(audio_path, start, end, fmt):
+    """Cache key for a segment: resolved path, mtime, size, window (ms precision) and format"""
+    st = os.stat(audio_path)
+    key = f"{os.path.realpath(audio_path)}:{st.st_mtime_ns}:{st.st_size}:{start:.3f}:{end:.3f}:{fmt}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _count(conn, name):
+    conn.execute('INSERT INTO counters (name, value) VALUES (?, 1) '
+                 'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+
+def segment_cache_get(key):
+    """
+    Looks up a cached segment and marks it as recently used.
+    Returns an open file object, or None on a miss.
+    """
+    conn = segment_cache_db()
+    try:
+        hit = conn.execute('UPDATE segments SET last_access = ? WHERE key = ?', (time.time(), key)).rowcount
+        if hit:
+            try:
+                # Open before returning so a concurrent eviction can't pull the file away
+                f = open(os.path.join(SEGMENT_CACHE_DIR, key), 'rb')
+                _count(conn, 'hits')
+                return f
+            except FileNotFoundError:
+                conn.execute('DELETE FROM segments WHERE key = ?', (key,))
+        _count(conn, 'misses')
+        return None
+    finally:
+        conn.close()
+
+
+def segment_cache_put(key, data):
+    """Stores a segment and evicts least recently used entries beyond the byte budget"""
+    if len(data) > SEGMENT_CACHE_MAX_BYTES:
+        return
+    path = os.path.join(SEGMENT_CACHE_DIR, key)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+    conn = segment_cache_db()
+    try:
+        # BEGIN IMMEDIATE serializes eviction across workers
+        conn.execute('BEGIN IMMEDIATE')
+        conn.execute('INSERT OR REPLACE INTO segments (key, size, last_access) VALUES (?, ?, ?)',
+                     (key, len(data), time.time()))
+        total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM segments').fetchone()[0]
+        evicted = []
+        if total > SEGMENT_CACHE_MAX_BYTES:
+            for old_key, size in conn.execute('SELECT key, size FROM segments ORDER BY last_access'):
+                if total <= SEGMENT_CACHE_MAX_BYTES:
+                    break
+                evicted.append(old_key)
+                total -= size
+            conn.executemany('DELETE FROM segments WHERE key = ?', [(k,) for k in evicted])
+            conn.execute('INSERT INTO counters (name, value) VALUES (\'evictions\', ?) '
+                         'ON CONFLICT(name) DO UPDATE SET value = value + excluded.value', (len(evicted),))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    for old_key in evicted:
+        try:
+            os.remove(os.path.join(SEGMENT_CACHE_DIR, old_key))
+        except FileNotFoundError:
+            pass
+
+
+def segment_cache_stats():
+    """Returns hit/miss counters and current size of the segment cache"""
+    conn = segment_cache_db()
+    try:
+        counters = dict(conn.execute('SELECT name, value FROM counters'))
+        entries, total = conn.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM segments').fetchone()
+    finally:
+        conn.close()
+    hits, misses = counters.get('hits', 0), counters.get('misses', 0)
+    return {
+        "hits": hits,
+        "misses": misses,
+        "evictions": counters.get('evictions', 0),
+        "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+        "entries": entries,
+        "bytes": total,
+        "max_bytes": SEGMENT_CACHE_MAX_BYTES
+    }
+
+
+def encode_pcm(pcm, sample_rate, channels, sample_width, fmt):
+    """Encodes raw PCM into one of the PROXY_FORMATS with ffmpeg"""
+    sample_format = 'u8' if sample_width == 1 else f's{8 * sample_width}le'
+    command = [AudioSegment.converter, '-v', 'error', '-f', sample_format, '-ar', str(sample_rate),
+               '-ac', str(channels), '-i', '-', *PROXY_FORMATS[fmt]['codec'],
+               '-f', 'ogg' if PROXY_FORMATS[fmt]['ext'] == 'ogg' else fmt, '-']
+    result = subprocess.run(command, input=pcm, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip() or "ffmpeg failed")
+    return result.stdout
+
+
+class DecoderBusy(Exception):
+    """Raised when the decode pool and its queue are full"""
+
+
+def run_decode(fn, *args):
+    """Runs a decode on the bounded pool and waits for it; raises DecoderBusy when the queue is full"""
+    if not decode_slots.acquire(blocking=False):
+        raise DecoderBusy("Too many decodes in progress")
+    try:
+        return decode_executor.submit(fn, *args).result()
+    finally:
+        decode_slots.release()
+
+
+def decode_segment(audio_path, seg_start, seg_end, fmt):
+    started = time.perf_counter()
+    pcm_data = read_segment_pcm(audio_path, seg_start, seg_end)
+    data = pcm_to_wav_bytes(*pcm_data) if fmt == 'wav' else encode_pcm(*pcm_data, fmt)
+    observe_stage('decode', started)
+    return data
+
+
+def segment_window(audio_path, start, end):
+    """The [start-5, end+5] window served around a selection, clipped to the file"""
+    duration = get_audio_info(audio_path)['duration']
+    seg_start = max(0, start - 5)
+    seg_end = end + 5 if duration is None else min(duration, end + 5)
+    return seg_start, seg_end
+
+
+def span_windows(audio_path, windows):
+    """
+    Splits windows (item, start, end) of one file into spans that are each decoded once.
+    A span ends at a gap over BATCH_SPAN_GAP or when it would exceed BATCH_MAX_SPAN seconds.
+    PCM WAV windows are read straight from the file, so they only share a span when they overlap.
+    """
+    max_gap = 0.0 if get_audio_info(audio_path)['wav_layout'] else BATCH_SPAN_GAP
+    spans, span, span_end = [], [], None
+    for window in sorted(windows, key=lambda window: window[1]):
+        if span and (window[1] - span_end > max_gap or max(span_end, window[2]) - span[0][1] > BATCH_MAX_SPAN):
+            spans.append(span)
+            span = []
+        span_end = window[2] if not span else max(span_end, window[2])
+        span.append(window)
+    if span:
+        spans.append(span)
+    return spans
+
+
+def get_segment(audio_path, start, end, fmt='wav'):
+    """
+    Returns the [start-5, end+5] window (clipped to the file) as a file object,
+    from the segment cache when possible. fmt is 'wav' or one of PROXY_FORMATS.
+    Cache misses are decoded on the bounded decode pool (see run_decode).
+    """
+    seg_start, seg_end = segment_window(audio_path, start, end)
+    key = segment_cache_key(audio_path, seg_start, seg_end, fmt)
+    cached = segment_cache_get(key)
+    if cached is None:
+        data = run_decode(decode_segment, audio_path, seg_start, seg_end, fmt)
+        segment_cache_put(key, data)
+        cached = BytesIO(data)
+    return cached
+
+
+@app.route('/audio_segment')
+def serve_audio_segment():
+    """
+    Serves a segment of an audio file, given filename, start, and end times (in seconds).
+    The segment is [start-5, end+5] seconds, clipped to file boundaries.
+    Only the requested window is decoded. Pass format=opus or format=mp3 for a compressed clip.
+    """
+    filename = request.args.get('file')
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    if not (filename and start is not None and end is not None):
+        return "Missing parameters", 400
+    if not current_directory:
+        return "No directory selected", 400
+    audio_path = resolve_audio_path(filename)
+    if not audio_path:
+        return "Audio file not found", 404
+    # WAV unless a compact format is requested explicitly (?format=opus|mp3)
+    fmt = request.args.get('format', 'wav')
+    if fmt != 'wav' and fmt not in PROXY_FORMATS:
+        return f"Unsupported format: {fmt}", 400
+    try:
+        ext = 'wav' if fmt == 'wav' else PROXY_FORMATS[fmt]['ext']
+        mimetype = 'audio/wav' if fmt == 'wav' else PROXY_FORMATS[fmt]['mimetype']
+        return send_file(get_segment(audio_path, start, end, fmt), mimetype=mimetype, as_attachment=False,
+                         download_name=f'{filename}_segment.{ext}')
+    except DecoderBusy:
+        return "Server busy decoding audio, retry shortly", 503, {'Retry-After': str(DECODE_RETRY_AFTER)}
+    except Exception as e:
+        app.logger.error(f"Error extracting audio segment: {e}")
+        return f"Error extracting audio segment: {str(e)}", 500
+
+def plan_segment_batch(segments):
+    """
+    Resolves and windows each requested segment. Returns (manifest, spans): one manifest
+    entry per segment (with an error if it can't be served), and per source file the
+    windows grouped into spans that are decoded in one go (see span_windows).
+    """
+    manifest, windows = [], {}
+    for index, segment in enumerate(segments):
+        entry = {'index': index}
+        manifest.append(entry)
+        try:
+            entry.update(file=str(segment['file']), start=float(segment['start']), end=float(segment['end']))
+        except (KeyError, TypeError, ValueError):
+            entry['error'] = "Missing or invalid file, start or end"
+            continue
+        audio_path = resolve_audio_path(entry['file'])
+        if not audio_path:
+            entry['error'] = "Audio file not found"
+            continue
+        seg_start, seg_end = segment_window(audio_path, entry['start'], entry['end'])
+        if seg_end - seg_start > BATCH_MAX_SPAN:
+            entry['error'] = f"Segments are limited to {BATCH_MAX_SPAN:.0f} seconds"
+            continue
+        windows.setdefault(audio_path, []).append((entry, seg_start, seg_end))
+    spans = [(audio_path, span) for audio_path, file_windows in windows.items()
+             for span in span_windows(audio_path, file_windows)]
+    return manifest, spans
+
+
+def cut_span_clips(audio_path, span, fmt):
+    """
+    Yields (entry, clip bytes) for a span of windows of one file, decoding the span once
+    and only if some window is not in the segment cache. Clips are added to the cache.
+    The decode runs on the bounded decode pool, so it raises DecoderBusy when that is full.
+    """
+    pcm_data = None
+    span_start = span[0][1]
+    for entry, seg_start, seg_end in span:
+        key = segment_cache_key(audio_path, seg_start, seg_end, fmt)
+        cached = segment_cache_get(key)
+        if cached is not None:
+            with cached:
+                yield entry, cached.read()
+            continue
+        if pcm_data is None:
+            started = time.perf_counter()
+            pcm_data = run_decode(read_segment_pcm, audio_path, span_start, max(window[2] for window in span))
+            observe_stage('decode', started)
+        pcm, sample_rate, channels, sample_width = pcm_data
+        frame_size = channels * sample_width
+        total_frames = len(pcm) // frame_size
+        span_offset = int(span_start * sample_rate)
+        first = min(max(int(seg_start * sample_rate) - span_offset, 0), total_frames)
+        last = min(max(int(seg_end * sample_rate) - span_offset, first), total_frames)
+        clip_pcm = pcm[first * frame_size:last * frame_size]
+        if fmt == 'wav':
+            clip = pcm_to_wav_bytes(clip_pcm, sample_rate, channels, sample_width)
+        else:
+            clip = encode_pcm(clip_pcm, sample_rate, channels, sample_width, fmt)
+        segment_cache_put(key, clip)
+        yield entry, clip
+
+
+@app.route('/audio_segments', methods=['POST'])
+def serve_audio_segments():
+    """
+    Batch version of /audio_segment.
+    Expected data: {"segments": [{file, start, end}, ...], optional format (wav, opus or mp3)}.
+    Streams a tar archive with one clip per segment (the same [start-5, end+5] windows)
+    followed by manifest.json, which maps each request index to its clip or an error.
+    Segments are grouped by source file and nearby windows are cut from a single decode.
+    """
+    data = request.get_json(silent=True) or {}
+    segments = data.get('segments')
+    fmt = data.get('format', 'wav')
+    if not isinstance(segments, list) or not segments:
+        return jsonify({"success": False, "message": "Expected a non-empty list of segments"}), 400
+    if len(segments) > BATCH_MAX_SEGMENTS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_SEGMENTS} segments per request"}), 400
+    if fmt != 'wav' and fmt not in PROXY_FORMATS:
+        return jsonify({"success": False, "message": f"Unsupported format: {fmt}"}), 400
+    ext = 'wav' if fmt == 'wav' else PROXY_FORMATS[fmt]['ext']
+    # Turn the batch away up front when the decoders are saturated, like /audio_segment
+    if not decode_slots.acquire(blocking=False):
+        return "Server busy decoding audio, retry shortly", 503, {'Retry-After': str(DECODE_RETRY_AFTER)}
+    decode_slots.release()
+    manifest, spans = plan_segment_batch(segments)
+
+    def generate():
+        buffer = BytesIO()
+        tar = tarfile.open(fileobj=buffer, mode='w|')
+
+        def add(name, payload):
+            member = tarfile.TarInfo(name)
+            member.size = len(payload)
+            member.mtime = int(time.time())
+            tar.addfile(member, BytesIO(payload))
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return chunk
+
+        for audio_path, span in spans:
+            stem = os.path.splitext(os.path.basename(audio_path))[0]
+            try:
+                for entry, clip in cut_span_clips(audio_path, span, fmt):
+                    entry['clip'] = f"{entry['index']:05d}_{stem}_{entry['start']:.3f}-{entry['end']:.3f}.{ext}"
+                    yield add(entry['clip'], clip)
+            except DecoderBusy:
+                # Later spans may still fit; these segments can be requested again
+                for entry, _, _ in span:
+                    if 'clip' not in entry:
+                        entry.update(error="Decoder busy, retry later", retry=True)
+            except Exception as e:
+                app.logger.error(f"Error extracting batch segments from {audio_path}: {e}")
+                for entry, _, _ in span:
+                    if 'clip' not in entry:
+                        entry['error'] = f"Error extracting audio segment: {str(e)}"
+        yield add('manifest.json', json.dumps(manifest, indent=2).encode('utf-8'))
+        tar.close()
+        yield buffer.getvalue()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-tar',
+                    headers={'Content-Disposition': 'attachment; filename=segments.tar'})
+
+
+@app.route('/segment_cache_stats')
+def get_segment_cache_stats():
+    """Returns hit/miss counters for the segment cache so it can be sized"""
+    return jsonify({"success": True, **segment_cache_stats()})
+
+
+@app.route('/')
+def index():
+    """
+    Renders the main HTML page for the client-side audio player.
+    """
+    return render_template('index.html') 
+
+# Audio catalog
+
+def catalog_db():
+    """Returns a connection to the audio catalog, creating the schema on first use"""
+    global catalog_ready
+    conn = connect_db(CATALOG_DB)
+    if not catalog_ready:
+        conn.execute('CREATE TABLE IF NOT EXISTS dirs '
+                     '(path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER NOT NULL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)')
+        conn.execute('CREATE TABLE IF NOT EXISTS files '
+                     '(path TEXT PRIMARY KEY, dir TEXT NOT NULL, basename TEXT NOT NULL, stem TEXT NOT NULL, '
+                     'size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, duration REAL, sample_rate INTEGER, '
+                     'channels INTEGER)')
+        try:
+            conn.execute('ALTER TABLE files ADD COLUMN channels INTEGER')
+        except sqlite3.OperationalError:
+            pass  # Column already exists
+        conn.execute('CREATE INDEX IF NOT EXISTS files_dir ON files (dir)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_basename ON files (basename)')
+        conn.execute('CREATE INDEX IF NOT EXISTS files_stem ON files (stem)')
+        catalog_ready = True
+    return conn
+
+
+def _delete_catalog_subtree(conn, dir_path):
+    prefix = dir_path + os.sep
+    conn.execute('DELETE FROM dirs WHERE path = ? OR substr(path, 1, ?) = ?', (dir_path, len(prefix), prefix))
+    conn.execute('DELETE FROM files WHERE dir = ? OR substr(dir, 1, ?) = ?', (dir_path, len(prefix), prefix))
+
+
+def catalog_scan(root):
+    """
+    Brings the catalog up to date for a directory tree.
+    Only directories whose mtime changed since the last scan are listed again;
+    unchanged directories are skipped using the subdirectories recorded for them.
+    Note that a directory's mtime changes when entries are added, removed or
+    renamed, not when an existing file is rewritten in place.
+    Changes are committed in short batches of whole directories, so the write lock
+    is never held for long and an interrupted scan resumes where it stopped.
+    Returns the number of directories that had to be listed.
+    """
+    root = os.path.abspath(root)
+    os.makedirs(os.path.dirname(CATALOG_DB), exist_ok=True)
+    # Only one worker scans at a time; the others then find the tree unchanged
+    with open(CATALOG_DB + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        conn = catalog_db()
+        listed = 0
+        batch_started = None
+
+        def begin():
+            nonlocal batch_started
+            if batch_started is None:
+                conn.execute('BEGIN IMMEDIATE')
+                batch_started = time.monotonic()
+
+        def commit():
+            nonlocal batch_started
+            if batch_started is not None:
+                conn.execute('COMMIT')
+                batch_started = None
+
+        try:
+            stack = [(root, os.path.dirname(root))]
+            while stack:
+                # Only commit between directories, so each one's files and mtime change together
+                if batch_started is not None and time.monotonic() - batch_started > CATALOG_COMMIT_SECONDS:
+                    commit()
+                dir_path, parent = stack.pop()
+                try:
+                    dir_mtime = os.stat(dir_path).st_mtime_ns
+                except OSError:
+                    begin()
+                    _delete_catalog_subtree(conn, dir_path)
+                    continue
+                row = conn.execute('SELECT mtime_ns FROM dirs WHERE path = ?', (dir_path,)).fetchone()
+                if row and row[0] == dir_mtime:
+                    stack.extend((sub, dir_path) for (sub,) in
+                                 conn.execute('SELECT path FROM dirs WHERE parent = ?', (dir_path,)))
+                    continue
+
+                listed += 1
+                subdirs, found = [], {}
+                with os.scandir(dir_path) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                subdirs.append(entry.path)
+                            elif entry.name.lower().endswith(SUPPORTED_AUDIO_EXTENSIONS):
+                                st = entry.stat()
+                                found[entry.path] = (st.st_size, st.st_mtime_ns)
+                        except OSError:
+                            continue
+
+                begin()
+                known = {path: (size, mtime) for path, size, mtime in
+                         conn.execute('SELECT path, size, mtime_ns FROM files WHERE dir = ?', (dir_path,))}
+                conn.executemany('DELETE FROM files WHERE path = ?', [(p,) for p in known.keys() - found.keys()])
+                conn.executemany(
+                    'INSERT OR REPLACE INTO files (path, dir, basename, stem, size, mtime_ns) VALUES (?, ?, ?, ?, ?, ?)',
+                    [(p, dir_path, os.path.basename(p), os.path.splitext(os.path.basename(p))[0], size, mtime)
+                     for p, (size, mtime) in found.items() if known.get(p) != (size, mtime)])
+
+                for (old_sub,) in conn.execute('SELECT path FROM dirs WHERE parent = ?', (dir_path,)).fetchall():
+                    if old_sub not in subdirs:
+                        _delete_catalog_subtree(conn, old_sub)
+                conn.execute('INSERT OR REPLACE INTO dirs (path, parent, mtime_ns) VALUES (?, ?, ?)',
+                             (dir_path, parent, dir_mtime))
+                stack.extend((sub, dir_path) for sub in subdirs)
+            commit()
+        except Exception:
+            if batch_started is not None:
+                conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+    return listed
+
+
+def catalog_files(root):
+    """
+    Returns the sorted full paths of all catalogued audio files under a directory,
+    and a dict mapping each path to its (duration, sample_rate, channels).
+    """
+    root = os.path.abspath(root)
+    prefix = root + os.sep
+    conn = catalog_db()
+    try:
+        rows = conn.execute(
+            'SELECT path, duration, sample_rate, channels FROM files '
+            'WHERE dir = ? OR substr(dir, 1, ?) = ? ORDER BY path',
+            (root, len(prefix), prefix)).fetchall()
+    finally:
+        conn.close()
+    return [row[0] for row in rows], {row[0]: row[1:] for row in rows}
+
+
+def catalog_record_info(audio_path, st, info):
+    """
+    Stores probed duration, sample rate and channels for a catalogued file.
+    Best effort: the header is cached in memory and can be probed again.
+    """
+    try:
+        catalog_record_infos([(os.path.abspath(audio_path), st.st_mtime_ns, info)])
+    except sqlite3.OperationalError as e:
+        app.logger.warning(f"Could not store metadata of {audio_path} in the catalog: {e}")
+
+
+def catalog_record_infos(results):
+    """Stores probed metadata for many files; results are (path, mtime_ns, info) tuples"""
+    conn = catalog_db()
+    try:
+        conn.executemany('UPDATE files SET duration = ?, sample_rate = ?, channels = ? WHERE path = ? AND mtime_ns = ?',
+                         [(info['duration'], info['sample_rate'], info['channels'], path, mtime_ns)
+                          for path, mtime_ns, info in results])
+    finally:
+        conn.close()
+
+
+def load_audio_directory(directory_path, rescan=True):
+    """
+    Rescans the catalog for a directory and rebuilds the playlist and filename index from it.
+    Returns (playlist, path_index, metadata).
+    """
+    if rescan:
+        started = time.perf_counter()
+        catalog_scan(directory_path)
+        observe_stage('directory_walk', started)
+    playlist, metadata = catalog_files(directory_path)
+    # Indexes every file by relative path, name and stem for CSV lookups
+    # (CSV has "ac083_2008-04-06" but file is "ac083_2008-04-06.mp3")
+    return playlist, PathIndex(directory_path, playlist), metadata
+
+
+def probe_audio_file(item):
+    """Process pool task: probes one file's header; returns (path, mtime_ns, info or None)"""
+    path, mtime_ns = item
+    try:
+        info = probe_audio_header(path)
+        info.pop('wav_layout', None)
+        return path, mtime_ns, info
+    except (OSError, ValueError, struct.error):
+        return path, mtime_ns, None
+
+
+def probe_catalog_metadata(root):
+    """
+    Probes the headers of every catalogued file under a directory that has no
+    metadata yet, in parallel processes, and stores the results in the catalog.
+    Returns the number of files probed, or None if another process is already probing.
+    """
+    root = os.path.abspath(root)
+    prefix = root + os.sep
+    with open(CATALOG_DB + '.metadata.lock', 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return None
+        conn = catalog_db()
+        try:
+            pending = conn.execute(
+                'SELECT path, mtime_ns FROM files WHERE duration IS NULL AND (dir = ? OR substr(dir, 1, ?) = ?)',
+                (root, len(prefix), prefix)).fetchall()
+        finally:
+            conn.close()
+        if not pending:
+            return 0
+        batch = []
+        with ProcessPoolExecutor(max_workers=METADATA_WORKERS, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for path, mtime_ns, info in pool.map(probe_audio_file, pending, chunksize=64):
+                if info is not None:
+                    batch.append((path, mtime_ns, info))
+                if len(batch) >= 1000:
+                    catalog_record_infos(batch)
+                    batch = []
+        if batch:
+            catalog_record_infos(batch)
+        return len(pending)
+
+
+def _probe_metadata_in_background(directory_path):
+    try:
+        probed = probe_catalog_metadata(directory_path)
+        if probed and current_directory == directory_path:
+            # Reload the playlist with durations here and in every other worker
+            apply_shared_state('directory', directory_path)
+            publish_state('directory', directory_path)
+    except Exception as e:
+        app.logger.error(f"Metadata probing for {directory_path} failed: {e}")
+
+
+def schedule_metadata_probe(directory_path):
+    """Starts probing metadata for the directory's files in a background thread"""
+    threading.Thread(target=_probe_metadata_in_background, args=(directory_path,), daemon=True).start()
+
+
+def watch_audio_directory(directory_path):
+    """
+    Keeps the catalog and playlist of the current directory up to date using
+    inotify (through watchdog) when CATALOG_WATCH=1 and watchdog is installed.
+    """
+    global catalog_observer
+    if not CATALOG_WATCH or Observer is None:
+        return
+    if catalog_observer is not None:
+        catalog_observer.stop()
+        catalog_observer = None
+
+    class CatalogEventHandler(FileSystemEventHandler):
+        def __init__(self):
+            self.timer = None
+
+        def refresh(self):
+            global current_playlist, audio_index, audio_metadata
+            try:
+                playlist, path_index, metadata = load_audio_directory(directory_path)
+                if current_directory == directory_path:
+                    current_playlist, audio_index, audio_metadata = playlist, path_index, metadata
+                    schedule_peaks_generation(current_playlist)
+                    schedule_proxy_generation(current_playlist)
+                    schedule_metadata_probe(directory_path)
+                    # Make the other workers reload the playlist from the catalog
+                    publish_state('directory', directory_path)
+            except Exception as e:
+                app.logger.error(f"Failed to refresh catalog for {directory_path}: {e}")
+
+        def on_any_event(self, event):
+            # Debounce bursts of events (e.g. a large copy) into a single rescan
+            if self.timer:
+                self.timer.cancel()
+            self.timer = threading.Timer(2.0, self.refresh)
+            self.timer.daemon = True
+            self.timer.start()
+
+    catalog_observer = Observer()
+    catalog_observer.daemon = True
+    catalog_observer.schedule(CatalogEventHandler(), directory_path, recursive=True)
+    catalog_observer.start()
+
+
+# Shared state across workers
+
+def state_db():
+    """Returns a connection to the shared state store, creating the schema on first use"""
+    global state_ready
+    conn = connect_db(STATE_DB)
+    if not state_ready:
+        conn.execute('CREATE TABLE IF NOT EXISTS state '
+                     '(key TEXT PRIMARY KEY, version INTEGER NOT NULL, payload BLOB NOT NULL)')
+        conn.execute('CREATE TABLE IF NOT EXISTS prefetch '
+                     '(client TEXT PRIMARY KEY, token TEXT NOT NULL, updated_at REAL NOT NULL)')
+        state_ready = True
+    return conn
+
+
+def publish_state(key, value, payload=None):
+    """
+    Stores loaded data so every worker picks it up on its next request.
+    The data is serialized once here, so the other workers never re-parse the source file.
+    Pass payload if the pickled value is already at hand.
+    """
+    if payload is None:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    conn = state_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        version = conn.execute('SELECT COALESCE(MAX(version), 0) + 1 FROM state').fetchone()[0]
+        conn.execute('INSERT OR REPLACE INTO state (key, version, payload) VALUES (?, ?, ?)',
+                     (key, version, payload))
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+    state_versions[key] = version
+
+
+def read_shared_state(key):
+    """Returns the value last published under `key`, or None"""
+    conn = state_db()
+    try:
+        row = conn.execute('SELECT payload FROM state WHERE key = ?', (key,)).fetchone()
+    finally:
+        conn.close()
+    return pickle.loads(row[0]) if row else None
+
+
+def apply_shared_state(key, value):
+    """Installs data published by another worker into this worker's globals"""
+    global csv_error_data, csv_file_loaded, parsed_transcription_data
+    global current_directory, current_playlist, audio_index, audio_metadata
+    if key == 'csv':
+        # Data published before the column stores existed is a list of dicts
+        csv_error_data = value if isinstance(value, RecordTable) else RecordTable.from_records(value)
+        csv_file_loaded = True
+    elif key == 'log':
+        parsed_transcription_data = value if isinstance(value, SegmentTable) else SegmentTable.from_dict(value)
+    elif key == 'directory':
+        # The publishing worker already rescanned, so just read the catalog
+        current_playlist, audio_index, audio_metadata = load_audio_directory(value, rescan=False)
+        current_directory = value
+    elif key == 'startup':
+        # Status left over from an earlier server run says nothing about this one
+        if value.get('run') == server_run_id():
+            startup_status.update(ready=value['ready'], message=value['message'])
+
+
+@app.before_request
+def sync_shared_state():
+    """Reloads any shared data that another worker has changed since this worker last looked"""
+    if request.endpoint == 'static':
+        return
+    refresh_shared_state()
+
+
+def refresh_shared_state():
+    """Applies every shared state key whose version differs from this process's copy"""
+    conn = state_db()
+    try:
+        for key, version in conn.execute('SELECT key, version FROM state').fetchall():
+            if state_versions.get(key) == version:
+                continue
+            row = conn.execute('SELECT version, payload FROM state WHERE key = ?', (key,)).fetchone()
+            apply_shared_state(key, pickle.loads(row[1]))
+            state_versions[key] = row[0]
+    except Exception as e:
+        app.logger.error(f"Failed to sync shared state: {e}")
+    finally:
+        conn.close()
+
+
+# Indexes and paginated queries
+
+def find_record(record_id):
+    """Returns the error record with the given id, or None"""
+    i = csv_error_data.find(record_id)
+    return csv_error_data[i] if i is not None else None
+
+
+def labeled_record_ids():
+    """Returns the set of record ids that have a saved label"""
+    return read_labels()['by_record'].keys()
+
+
+def page_args():
+    """Reads the cursor and limit query parameters"""
+    cursor = max(request.args.get('cursor', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    return cursor, limit
+
+
+def paginate(candidates, cursor, limit, matches):
+    """
+    Walks a candidate list from the cursor, keeping items that satisfy `matches`,
+    until `limit` items are found. Returns (items, next_cursor); next_cursor is
+    None when the candidates are exhausted.
+    """
+    items = []
+    position = cursor
+    while position < len(candidates) and len(items) < limit:
+        if matches(candidates[position]):
+            items.append(candidates[position])
+        position += 1
+    return items, (position if position < len(candidates) else None)
+
+
+def file_info(f_path):
+    """Builds the playlist entry for an audio file"""
+    f_name = os.path.basename(f_path)
+    relative = audio_index.path_name(f_path)
+    duration, sample_rate, channels = audio_metadata.get(f_path, (None, None, None))
+    return {
+        "name": f_name,
+        "path": relative,
+        # The relative path, so same-named files in different subdirectories stay distinct
+        "url": f'/audio_files/{quote(relative)}',
+        "duration": duration,
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "error_segments": file_error_segments(f_path)
+    }
+
+
+def total_duration():
+    """Sum of the known durations of the files in the playlist, in seconds"""
+    return sum(audio_metadata[f_path][0] or 0.0 for f_path in current_playlist if f_path in audio_metadata)
+
+
+@app.route('/records')
+def query_records():
+    """
+    Returns one page of error records.
+    Filters: file (exact record_file), q (phrase substring, case-insensitive),
+    labeled (true/false), start/end (record time range in seconds).
+    Without a file filter a time range is served from the time index, in time order.
+    Pass the returned next_cursor to fetch the following page.
+    """
+    if not csv_file_loaded:
+        return jsonify({"success": False, "message": "No CSV data loaded", "data": []})
+    cursor, limit = page_args()
+    record_file = request.args.get('file')
+    phrase = request.args.get('q', '').lower()
+    labeled = request.args.get('labeled')
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+
+    # File and time range filters run on the columns; the phrase is checked row by row
+    candidates = csv_error_data.select(record_file, start, end)
+    labeled_ids = labeled_record_ids()
+    if labeled is not None:
+        is_labeled = np.isin(csv_error_data.record_ids[candidates], list(labeled_ids))
+        candidates = candidates[is_labeled == (labeled.lower() == 'true')]
+
+    def matches(i):
+        return not phrase or phrase in csv_error_data.phrases[csv_error_data.phrase_ids[i]].lower()
+
+    indices, next_cursor = paginate(candidates, cursor, limit, matches)
+    return jsonify({
+        "success": True,
+        "data": [dict(csv_error_data[i], index=int(i), labeled=str(csv_error_data.record_ids[i]) in labeled_ids)
+                 for i in indices],
+        "next_cursor": next_cursor,
+        "total": len(csv_error_data)
+    })
+
+
+@app.route('/records/<record_id>')
+def get_record(record_id):
+    """Looks up a single error record by its record id"""
+    i = csv_error_data.find(record_id)
+    if i is None:
+        return jsonify({"success": False, "message": f"Record {record_id} not found"}), 404
+    return jsonify({"success": True, "data": dict(csv_error_data[i], index=i)})
+
+
+@app.route('/playlist')
+def query_playlist():
+    """
+    Returns one page of the playlist with each file's error segments.
+    Filters: file (file name, stem or relative path; every match is listed),
+    q (file name substring, case-insensitive).
+    """
+    cursor, limit = page_args()
+    record_file = request.args.get('file')
+    name_filter = request.args.get('q', '').lower()
+    if record_file is not None:
+        candidates = audio_index.candidates(record_file)
+    else:
+        candidates = current_playlist
+
+    def matches(f_path):
+        return not name_filter or name_filter in os.path.basename(f_path).lower()
+
+    paths, next_cursor = paginate(candidates, cursor, limit, matches)
+    return jsonify({
+        "success": True,
+        "currentDirectory": current_directory,
+        "data": [file_info(f_path) for f_path in paths],
+        "next_cursor": next_cursor,
+        "total": len(current_playlist)
+    })
+
+
+@app.route('/error_segments')
+def query_error_segments():
+    """
+    Returns one page of a file's transcription error segments in time order,
+    optionally limited to segments whose long-form start lies in [start, end].
+    """
+    names = log_file_names(request.args.get('file', ''))
+    cursor, limit = page_args()
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', type=float)
+    rows = np.concatenate([parsed_transcription_data.rows_by_start(name, start, end) for name in names]
+                          or [np.zeros(0, dtype=np.int64)])
+    if len(names) > 1:
+        # Interleave the names' segments by start, again with missing starts last
+        starts = parsed_transcription_data.times['longFormStart'][rows]
+        rows = rows[np.argsort(np.where(np.isnan(starts), np.inf, starts), kind='stable')]
+    order, next_cursor = paginate(rows, cursor, limit, lambda i: True)
+    return jsonify({
+        "success": True,
+        "data": [parsed_transcription_data.segment(i) for i in order],
+        "next_cursor": next_cursor,
+        "total": sum(parsed_transcription_data.count(name) for name in names)
+    })
+
+
+@app.route('/overlaps')
+def query_overlaps():
+    """
+    Returns the transcription error spans (long- and short-form) and the saved labels of a
+    file that overlap [start, end] (end defaults to start, i.e. what covers one instant).
+    The file may be given as any name resolve_audio_path accepts.
+    """
+    filename = request.args.get('file', '')
+    start = request.args.get('start', type=float)
+    end = request.args.get('end', start, type=float)
+    if not filename or start is None:
+        return jsonify({"success": False, "message": "Missing file or start"}), 400
+    rows, index = label_intervals()
+    _, segment_index = resolved_segments()
+    return jsonify({
+        "success": True,
+        "segments": [parsed_transcription_data.interval(row)
+                     for row in segment_index.overlapping(filename, start, end)],
+        "labels": [rows[i] for i in index.overlapping(filename, start, end)]
+    })
+
+
+@app.route('/nearest_error')
+def query_nearest_error():
+    """
+    Returns the transcription error span of a file closest to `time`, with its distance
+    in seconds (0 when the span covers it), or null if the file has no error segments.
+    """
+    filename = request.args.get('file', '')
+    time_point = request.args.get('time', type=float)
+    if not filename or time_point is None:
+        return jsonify({"success": False, "message": "Missing file or time"}), 400
+    nearest = resolved_segments()[1].nearest(filename, time_point)
+    if nearest is None:
+        return jsonify({"success": True, "segment": None})
+    row, distance = nearest
+    return jsonify({"success": True, "segment": dict(parsed_transcription_data.interval(row), distance=distance)})
+
+
+# Streaming data loads and background jobs
+
+def create_job(kind, total_bytes):
+    """Registers a background load job in the shared store and returns its id"""
+    job_id = uuid.uuid4().hex
+    conn = state_db()
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, kind TEXT, status TEXT, '
+                     'bytes_read INTEGER, total_bytes INTEGER, rows INTEGER, message TEXT, updated_at REAL)')
+        conn.execute('INSERT INTO jobs VALUES (?, ?, ?, 0, ?, 0, ?, ?)',
+                     (job_id, kind, 'running', total_bytes, '', time.time()))
+    finally:
+        conn.close()
+    return job_id
+
+
+def update_job(job_id, **fields):
+    """Updates progress fields of a background job"""
+    if not job_id:
+        return
+    fields['updated_at'] = time.time()
+    assignments = ', '.join(f'{name} = ?' for name in fields)
+    conn = state_db()
+    try:
+        conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+    finally:
+        conn.close()
 
-@app.route('/audio_segment')
-def serve_audio_segment():
+
+def get_job(job_id):
+    """Returns a background job as a dict, or None if it does not exist"""
+    conn = state_db()
+    try:
+        conn.row_factory = sqlite3.Row
+        row = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        return dict(row) if row else None
+    except sqlite3.OperationalError:
+        return None  # No job has been created yet
+    finally:
+        conn.close()
+
+
+def load_data_stream(kind, raw, job_id=None):
     """
-    Serves a segment of an audio file, given filename, start, and end times (in seconds).
-    The segment is [start-5, end+5] seconds, clipped to file boundaries.
+    Streams a CSV error file ('csv') or transcription log ('log') into the shared store.
+    Returns the number of error records (csv) or files with error segments (log).
     """
-    filename = request.args.get('file')
-    start = request.args.get('start', type=float)
-    end = request.args.get('end', type=float)
-    if not (filename and start is not None and end is not None):
-        return "Missing parameters", 400
-    if not current_directory:
-        return "No directory selected", 400
-    audio_path = os.path.join(current_directory, filename)
-    if not os.path.exists(audio_path):
-        return "Audio file not found", 404
+    progress, text = open_text_stream(raw)
+
+    def report(rows):
+        update_job(job_id, bytes_read=progress.bytes_read, rows=rows)
+
+    started = time.perf_counter()
+    if kind == 'csv':
+        value = RecordTable.from_records(iter_csv_records(text, report))
+    else:
+        value = parse_log_stream(text, report)
+    observe_stage(f'{kind}_parse', started)
+    apply_shared_state(kind, value)
+    publish_state(kind, value)
+    update_job(job_id, bytes_read=progress.bytes_read, rows=len(value))
+    return len(value)
+
+
+def run_load_job(job_id, kind, path, remove_after=False):
+    """Background thread body: loads a file from disk and records the outcome on the job"""
     try:
-        audio = AudioSegment.from_file(audio_path)
-        duration = len(audio) / 1000.0  # in seconds
-        seg_start = max(0, start - 5)
-        seg_end = min(duration, end + 5)
-        seg_audio = audio[int(seg_start * 1000):int(seg_end * 1000)]
-        # Write to a temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.wav') as tmpf:
-            seg_audio.export(tmpf.name, format='wav')
-            tmpf.flush()
-            return send_file(tmpf.name, mimetype='audio/wav', as_attachment=False, download_name=f'{filename}_segment.wav')
+        with open(path, 'rb') as f:
+            count = load_data_stream(kind, f, job_id)
+        noun = "error records" if kind == 'csv' else "entries"
+        message = f"Loaded successfully. {count} {noun} found."
+        if kind == 'csv':
+            missing, ambiguous = report_record_file_matches()
+            message += unmatched_message(missing, ambiguous)
+        update_job(job_id, status='done', message=message)
     except Exception as e:
-        app.logger.error(f"Error extracting audio segment: {e}")
-        return f"Error extracting audio segment: {str(e)}", 500
+        app.logger.error(f"Background {kind} load of '{path}' failed: {e}")
+        update_job(job_id, status='failed', message=str(e))
+    finally:
+        if remove_after:
+            os.remove(path)
 
-@app.route('/')
-def index():
+
+def start_load_job(kind, path=None, upload=None):
     """
-    Renders the main HTML page for the client-side audio player.
+    Starts loading a file in a background thread and returns the job id.
+    Uploads are spooled to a temp file first because the request stream closes with the response.
     """
-    return render_template('index.html') 
+    remove_after = False
+    if upload is not None:
+        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{kind}') as spooled:
+            shutil.copyfileobj(upload.stream, spooled, PARSE_CHUNK_SIZE)
+            path = spooled.name
+        remove_after = True
+    job_id = create_job(kind, os.path.getsize(path))
+    threading.Thread(target=run_load_job, args=(job_id, kind, path, remove_after), daemon=True).start()
+    return job_id
+
+
+def wants_background():
+    return request.form.get('background', '').lower() in ('1', 'true', 'yes')
+
+
+@app.route('/jobs/<job_id>')
+def get_job_status(job_id):
+    """Returns the progress of a background load job"""
+    job = get_job(job_id)
+    if not job:
+        return jsonify({"success": False, "message": "Job not found"}), 404
+    return jsonify({"success": True, **job})
+
 
 @app.route('/select_directory', methods=['POST'])
 def select_directory():
@@ -152,7 +2311,7 @@ def select_directory():
     Handles the selection of an audio directory and populates the playlist.
     Now also includes transcription data if a log file has been uploaded/loaded.
     """
-    global current_directory, current_playlist, audio_file_map
+    global current_directory, current_playlist, audio_index, audio_metadata
 
     directory_path = request.form.get('directory_path')
 
@@ -163,67 +2322,47 @@ def select_directory():
         return jsonify({"success": False, "message": "Invalid directory path."})
 
     current_directory = directory_path
-    current_playlist = []
-    audio_file_map = {}
-    
-    # Recursively load all audio files from the directory and subdirectories
-    for root, _, files in os.walk(directory_path):
-        for filename in files:
-            if filename.lower().endswith(SUPPORTED_AUDIO_EXTENSIONS):
-                full_path = os.path.join(root, filename)
-                current_playlist.append(full_path)
-                # Map just the filename to the full path for CSV lookups
-                audio_file_map[filename] = full_path
-                # Also map filename without extension for CSV compatibility
-                # (CSV has "ac083_2008-04-06" but file is "ac083_2008-04-06.mp3")
-                name_without_ext = os.path.splitext(filename)[0]
-                audio_file_map[name_without_ext] = full_path
-    
-    current_playlist.sort()
+    current_playlist, audio_index, audio_metadata = load_audio_directory(directory_path)
+    publish_state('directory', directory_path)
+    watch_audio_directory(directory_path)
+    schedule_peaks_generation(current_playlist)
+    schedule_proxy_generation(current_playlist)
+    schedule_metadata_probe(directory_path)
+    if csv_file_loaded:
+        report_record_file_matches()
     
     files_with_transcription_info = []
-
-    for f_path in current_playlist:
-        f_name = os.path.basename(f_path)
-        file_url = f'/audio_files/{f_name}'
-        error_segments = parsed_transcription_data.get(f_name, [])
-        files_with_transcription_info.append({
-            "name": f_name,
-            "url": file_url,
-            "error_segments": error_segments
-        })
+    # Pass include_files=0 to skip the listing and page through /playlist instead
+    if request.form.get('include_files', '1') != '0':
+        files_with_transcription_info = [file_info(f_path) for f_path in current_playlist]
 
     return jsonify({
         "success": True,
         "message": f"Directory selected: {directory_path}",
-        "files_with_info": files_with_transcription_info
+        "files_with_info": files_with_transcription_info,
+        "fileCount": len(current_playlist),
+        "totalDuration": total_duration()
     })
 
 @app.route('/upload_log', methods=['POST'])
 def upload_log():
     """
     Handles the upload of the log file directly from the client.
+    The upload is parsed as a stream; pass background=1 to parse it as a background job.
     """
-    global parsed_transcription_data
-    
-    log_content = None
-
-    if 'log_file' in request.files:
-        uploaded_file = request.files['log_file']
-        if uploaded_file.filename != '':
-            log_content = uploaded_file.read().decode('utf-8')
-    
-    if not log_content:
+    uploaded_file = request.files.get('log_file')
+    if not uploaded_file or uploaded_file.filename == '':
         return jsonify({"success": False, "message": "No log file provided."})
 
     try:
-        parsed_transcription_data = parse_log_content(log_content)
-        # Re-select directory to refresh playlist with new transcription data
-        if current_directory:
-            pass # The frontend will call selectDirectory() after a successful upload
+        if wants_background():
+            job_id = start_load_job('log', upload=uploaded_file)
+            return jsonify({"success": True, "message": "Log file upload is being parsed.", "job_id": job_id})
+        count = load_data_stream('log', uploaded_file.stream)
+        # The frontend will call selectDirectory() after a successful upload
         return jsonify({
             "success": True,
-            "message": f"Log file uploaded and parsed successfully. {len(parsed_transcription_data)} entries found."
+            "message": f"Log file uploaded and parsed successfully. {count} entries found."
         })
     except Exception as e:
         app.logger.error(f"Error parsing uploaded log file: {e}")
@@ -233,9 +2372,8 @@ def upload_log():
 def load_log_from_path():
     """
     Handles loading the log file from a specified path on the server system.
+    The file is parsed as a stream; pass background=1 to parse it as a background job.
     """
-    global parsed_transcription_data
-    
     log_file_path = request.form.get('log_path')
 
     if not log_file_path:
@@ -248,16 +2386,15 @@ def load_log_from_path():
         return jsonify({"success": False, "message": f"Provided path is not a file: {log_file_path}"})
 
     try:
-        with open(log_file_path, 'r', encoding='utf-8') as f:
-            log_content = f.read()
-        
-        parsed_transcription_data = parse_log_content(log_content)
-        # Re-select directory to refresh playlist with new transcription data
-        if current_directory:
-            pass # The frontend will call selectDirectory() after a successful load
+        if wants_background():
+            job_id = start_load_job('log', path=log_file_path)
+            return jsonify({"success": True, "message": "Log file is being parsed.", "job_id": job_id})
+        with open(log_file_path, 'rb') as f:
+            count = load_data_stream('log', f)
+        # The frontend will call selectDirectory() after a successful load
         return jsonify({
             "success": True,
-            "message": f"Log file loaded from path and parsed successfully. {len(parsed_transcription_data)} entries found."
+            "message": f"Log file loaded from path and parsed successfully. {count} entries found."
         })
     except Exception as e:
         app.logger.error(f"Error loading or parsing log file from path '{log_file_path}': {e}")
@@ -270,26 +2407,28 @@ def get_status():
     Returns the current status of the player, including directory and playlist info.
     Now also indicates if a log file has been loaded and includes transcription data.
     """
-    files_with_transcription_info = []
-    # If a directory has been selected, build the current playlist data for status
-    if current_directory:
-        for f_path in current_playlist:
-            f_name = os.path.basename(f_path)
-            file_url = f'/audio_files/{f_name}'
-            error_segments = parsed_transcription_data.get(f_name, [])
-            files_with_transcription_info.append({
-                "name": f_name,
-                "url": file_url,
-                "error_segments": error_segments
-            })
+    # Pass include_files=0 to skip the file list and page through /playlist instead
+    include_files = request.args.get('include_files', '1') != '0'
 
-    return jsonify({
-        "currentDirectory": current_directory,
-        "files_with_info": files_with_transcription_info,
-        "logLoaded": bool(parsed_transcription_data),
-        "csvLoaded": csv_file_loaded,
-        "csvRecordCount": len(csv_error_data)
-    })
+    def build():
+        files_with_transcription_info = []
+        # If a directory has been selected, build the current playlist data for status.
+        if current_directory and include_files:
+            files_with_transcription_info = [file_info(f_path) for f_path in current_playlist]
+        return {
+            "currentDirectory": current_directory,
+            "files_with_info": files_with_transcription_info,
+            "fileCount": len(current_playlist),
+            "totalDuration": total_duration(),
+            "logLoaded": bool(parsed_transcription_data),
+            "csvLoaded": csv_file_loaded,
+            "csvRecordCount": len(csv_error_data),
+            "ready": startup_status['ready']
+        }
+
+    version = (current_directory, [state_versions.get(key) for key in ('directory', 'log', 'csv')],
+               startup_status['ready'])
+    return versioned_json(f'status:{include_files}', version, build)
 
 
 # Error labeling routes
@@ -302,65 +2441,45 @@ def labeling():
 
 @app.route('/load_csv', methods=['POST'])
 def load_csv():
-    """Load CSV error data from file upload or path"""
-    global csv_error_data, csv_file_loaded
-    
+    """
+    Load CSV error data from file upload or path.
+    The file is parsed as a stream; pass background=1 to parse it as a background job.
+    """
     try:
-        csv_content = None
+        upload = None
+        csv_path = None
         
         # Check if file was uploaded
         if 'csv_file' in request.files:
             file = request.files['csv_file']
             if file and file.filename:
-                csv_content = file.read().decode('utf-8')
+                upload = file
         
         # Check if path was provided
         elif 'csv_path' in request.form:
             csv_path = request.form['csv_path'].strip()
-            if csv_path and os.path.exists(csv_path):
-                with open(csv_path, 'r', encoding='utf-8') as f:
-                    csv_content = f.read()
-            else:
+            if not (csv_path and os.path.exists(csv_path)):
                 return jsonify({"success": False, "message": f"CSV file not found at path: {csv_path}"})
         
-        if not csv_content:
+        if upload is None and csv_path is None:
             return jsonify({"success": False, "message": "No CSV file provided"})
-        
-        # Parse CSV content
-        csv_error_data = []
-        reader = csv.DictReader(StringIO(csv_content))
-        
-        for row in reader:
-            # Map actual CSV columns to expected format
-            if all(col in row for col in ['recordErrorID', 'recordFile', 'exampleExample', 'recordTime']):
-                # Skip rows where recordTime is empty or invalid
-                try:
-                    record_time = time_to_seconds(row['recordTime']) if row['recordTime'].strip() else 0.0
-                    record_file = row['recordFile'].strip()
-                    
-                    # Debug logging
-                    app.logger.info(f"Processing CSV row: ID={row['recordErrorID']}, File='{record_file}', Time={record_time}")
-                    
-                    # Skip rows with empty filenames
-                    if not record_file:
-                        app.logger.warning(f"Skipping row {row['recordErrorID']} - empty filename")
-                        continue
-                    
-                    csv_error_data.append({
-                        'record_id': row['recordErrorID'],
-                        'record_file': record_file,
-                        'example_phrase': row['exampleExample'],
-                        'record_time': record_time
-                    })
-                except (ValueError, AttributeError) as e:
-                    app.logger.warning(f"Skipping invalid row: {e}")
-                    continue  # Skip rows with invalid time values
-        
-        csv_file_loaded = True
+
+        if wants_background():
+            job_id = start_load_job('csv', path=csv_path, upload=upload)
+            return jsonify({"success": True, "message": "CSV is being loaded.", "job_id": job_id})
+
+        if upload is not None:
+            count = load_data_stream('csv', upload.stream)
+        else:
+            with open(csv_path, 'rb') as f:
+                count = load_data_stream('csv', f)
+        missing, ambiguous = report_record_file_matches()
         return jsonify({
             "success": True, 
-            "message": f"CSV loaded successfully. {len(csv_error_data)} error records found.",
-            "record_count": len(csv_error_data)
+            "message": f"CSV loaded successfully. {count} error records found.{unmatched_message(missing, ambiguous)}",
+            "record_count": count,
+            "missing_files": missing[:100],
+            "ambiguous_files": ambiguous[:100]
         })
         
     except Exception as e:
@@ -373,13 +2492,195 @@ def get_csv_data():
     if not csv_file_loaded:
         return jsonify({"success": False, "message": "No CSV data loaded"})
     
-    return jsonify({
+    return versioned_json('csv_data', state_versions.get('csv'), lambda: {
         "success": True,
-        "data": csv_error_data,
+        "data": csv_error_data.to_list(),
         "count": len(csv_error_data)
     })
 
 
+# Label store
+
+def labels_lock(exclusive):
+    """
+    Opens and locks the labels lock file (shared for readers, exclusive for writers).
+    The returned file must be closed to release the lock.
+    """
+    os.makedirs(os.path.dirname(LABELS_FILE), exist_ok=True)
+    lock_file = open(LABELS_FILE + '.lock', 'a')
+    fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+    return lock_file
+
+
+def commit_labels(batch):
+    """Appends a batch of labels to the CSV with a single write and fsync"""
+    started = time.perf_counter()
+    lock_file = labels_lock(exclusive=True)
+    try:
+        with open(LABELS_FILE, 'a', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=LABEL_FIELDNAMES)
+            # Write header if file is new
+            if csvfile.tell() == 0:
+                writer.writeheader()
+            writer.writerows(batch)
+            csvfile.flush()
+            os.fsync(csvfile.fileno())
+    finally:
+        lock_file.close()
+    observe_stage('label_write', started)
+
+
+def label_writer():
+    """Writer thread: drains the label queue and group-commits what arrives together"""
+    while True:
+        pending = [label_queue.get()]
+        deadline = time.monotonic() + LABEL_COMMIT_WINDOW
+        while len(pending) < LABEL_COMMIT_MAX_BATCH:
+            try:
+                pending.append(label_queue.get(timeout=max(deadline - time.monotonic(), 0)))
+            except queue.Empty:
+                break
+        try:
+            commit_labels([label for label, _ in pending])
+            error = None
+        except Exception as e:
+            app.logger.error(f"Error committing {len(pending)} labels: {e}")
+            error = e
+        for _, waiter in pending:
+            waiter['error'] = error
+            waiter['done'].set()
+
+
+def submit_labels(labels, timeout=30):
+    """Queues labels for the writer thread and waits until they are durably written"""
+    global label_writer_pid
+    with label_writer_lock:
+        # Started lazily so each gunicorn worker gets its own thread after fork
+        if label_writer_pid != os.getpid():
+            threading.Thread(target=label_writer, daemon=True).start()
+            label_writer_pid = os.getpid()
+    waiters = []
+    for label in labels:
+        waiter = {'done': threading.Event(), 'error': None}
+        label_queue.put((label, waiter))
+        waiters.append(waiter)
+    for waiter in waiters:
+        if not waiter['done'].wait(timeout):
+            raise TimeoutError("Timed out waiting for the label to be written")
+        if waiter['error']:
+            raise waiter['error']
+
+
+def read_labels():
+    """
+    Returns the saved labels, reading only the bytes appended since the last call.
+    The file is re-read from the start if it was deleted or replaced.
+    """
+    with labels_cache_lock:
+        try:
+            st = os.stat(LABELS_FILE)
+        except FileNotFoundError:
+            labels_cache.update(file_id=None, offset=0, fieldnames=None, rows=[], by_record={})
+            return labels_cache
+        file_id = (st.st_dev, st.st_ino)
+        if labels_cache['file_id'] != file_id or st.st_size < labels_cache['offset']:
+            labels_cache.update(file_id=file_id, offset=0, fieldnames=None, rows=[], by_record={})
+        if st.st_size == labels_cache['offset']:
+            return labels_cache
+
+        lock_file = labels_lock(exclusive=False)
+        try:
+            with open(LABELS_FILE, 'rb') as f:
+                f.seek(labels_cache['offset'])
+                chunk = f.read()
+        finally:
+            lock_file.close()
+        reader = csv.DictReader(StringIO(chunk.decode('utf-8'), newline=''),
+                                fieldnames=labels_cache['fieldnames'])
+        for row in reader:
+            # Ensure all expected fields exist with defaults
+            segment = {
+                'record_id': row.get('record_id', ''),
+                'audio_file': row.get('audio_file', ''),
+                'error_phrase': row.get('error_phrase', ''),  # Handle missing column
+                'start_time': row.get('start_time', '0'),
+                'end_time': row.get('end_time', '0'),
+                'duration': row.get('duration', '0'),
+                'labeled_at': row.get('labeled_at', '')
+            }
+            labels_cache['by_record'].setdefault(segment['record_id'], []).append(len(labels_cache['rows']))
+            labels_cache['rows'].append(segment)
+        labels_cache['fieldnames'] = reader.fieldnames
+        labels_cache['offset'] += len(chunk)
+        return labels_cache
+
+
+def label_time(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+def label_intervals():
+    """
+    Returns (rows, GrowingIntervalIndex) for the saved labels; the index maps to positions in rows.
+    Label file names are matched through the audio directory (see audio_key).
+    New labels are appended to the index; it's built from scratch only when the labels file
+    was replaced, the directory changed, or more labels arrived than are worth appending.
+    """
+    global label_intervals_cache
+    labels = read_labels()
+    current_index = audio_index
+    with labels_cache_lock:
+        rows = labels['rows']
+        cached_rows, cached_count, cached_audio_index, index = label_intervals_cache
+        if (cached_rows is not rows or cached_audio_index is not current_index
+                or len(rows) - cached_count > LABEL_INDEX_MERGE_AFTER):
+            files = {}
+            name_ids = np.array([files.setdefault(row['audio_file'], len(files)) for row in rows], dtype=np.int64)
+            index = GrowingIntervalIndex(list(files),
+                                         name_ids,
+                                         np.array([label_time(row['start_time']) for row in rows], dtype=np.float64),
+                                         np.array([label_time(row['end_time']) for row in rows], dtype=np.float64),
+                                         np.arange(len(rows)),
+                                         audio_key,
+                                         LABEL_INDEX_MERGE_AFTER)
+        else:
+            for i in range(cached_count, len(rows)):
+                index.append(rows[i]['audio_file'], label_time(rows[i]['start_time']),
+                             label_time(rows[i]['end_time']), i)
+        label_intervals_cache = (rows, len(rows), current_index, index)
+        return rows, index
+
+
+def make_label(data):
+    """Builds the row stored for a labeled region, with the error phrase from the CSV data"""
+    error_record = find_record(data['record_id'])
+    error_phrase = error_record['example_phrase'] if error_record else ""
+    return {
+        'record_id': data['record_id'],
+        'audio_file': data['audio_file'],
+        'error_phrase': error_phrase,
+        'start_time': round(data['start_time'], 3),
+        'end_time': round(data['end_time'], 3),
+        'duration': round(data['end_time'] - data['start_time'], 3),
+        'labeled_at': datetime.datetime.now().isoformat()
+    }
+
+
+def label_error(data):
+    """Returns why a submitted label is invalid, or None"""
+    if not isinstance(data, dict) or not all(key in data for key in LABEL_REQUIRED_FIELDS):
+        return "Missing required fields"
+    if not all(isinstance(data[key], (int, float)) and not isinstance(data[key], bool)
+               for key in ['start_time', 'end_time']):
+        return "start_time and end_time must be numbers"
+    if data['start_time'] < 0 or data['end_time'] < data['start_time']:
+        return "Invalid time range"
+    return None
+
+
 @app.route('/save_label', methods=['POST'])
 def save_label():
     """Save a labeled error region to CSV file"""
@@ -387,54 +2688,31 @@ def save_label():
         data = request.get_json()
         
         # Expected data: record_id, start_time, end_time, audio_file
-        if not all(key in data for key in ['record_id', 'start_time', 'end_time', 'audio_file']):
+        if not all(key in data for key in LABEL_REQUIRED_FIELDS):
             return jsonify({"success": False, "message": "Missing required fields"})
         
-        # Find the error phrase from the original CSV data
-        error_phrase = ""
-        for error_record in csv_error_data:
-            if str(error_record['record_id']) == str(data['record_id']):
-                error_phrase = error_record['example_phrase']
-                break
-        
-        # Prepare the labeled data
-        label_data = {
-            'record_id': data['record_id'],
-            'audio_file': data['audio_file'],
-            'error_phrase': error_phrase,
-            'start_time': round(data['start_time'], 3),
-            'end_time': round(data['end_time'], 3),
-            'duration': round(data['end_time'] - data['start_time'], 3),
-            'labeled_at': __import__('datetime').datetime.now().isoformat()
-        }
+        label_data = make_label(data)
         
+        # Existing labels of other records on the same stretch of audio (likely duplicates)
+        rows, index = label_intervals()
+        overlapping = {rows[i]['record_id']
+                       for i in index.overlapping(data['audio_file'], data['start_time'], data['end_time'])}
+        overlapping = sorted(overlapping - {str(data['record_id'])})
+
         # Save to CSV file
-        output_file = "/opt/data/labeled-segments.csv"
-        
-        # Check if file exists to determine if we need to write headers
-        file_exists = os.path.exists(output_file)
-        
-        # Ensure the directory exists
-        os.makedirs("/opt/data", exist_ok=True)
-        
-        with open(output_file, 'a', newline='', encoding='utf-8') as csvfile:
-            fieldnames = ['record_id', 'audio_file', 'error_phrase', 'start_time', 'end_time', 'duration', 'labeled_at']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            
-            # Write header if file is new
-            if not file_exists:
-                writer.writeheader()
-            
-            # Write the labeled data
-            writer.writerow(label_data)
+        submit_labels([label_data])
         
-        app.logger.info(f"Label saved to {output_file}: Record {data['record_id']}, "
+        app.logger.info(f"Label saved to {LABELS_FILE}: Record {data['record_id']}, "
                        f"Time: {data['start_time']:.3f}-{data['end_time']:.3f}s, "
                        f"File: {data['audio_file']}")
         
+        message = f"Label saved for record {data['record_id']} to {LABELS_FILE}"
+        if overlapping:
+            message += f" (overlaps labels of records {', '.join(overlapping)})"
         return jsonify({
             "success": True,
-            "message": f"Label saved for record {data['record_id']} to {output_file}"
+            "message": message,
+            "overlapping_labels": overlapping
         })
         
     except Exception as e:
@@ -442,10 +2720,38 @@ def save_label():
         return jsonify({"success": False, "message": f"Error saving label: {str(e)}"})
 
 
+@app.route('/save_labels', methods=['POST'])
+def save_labels():
+    """
+    Saves many labeled regions at once.
+    Expected data: {"labels": [{record_id, start_time, end_time, audio_file}, ...]}.
+    Every label is validated first and nothing is saved if any is invalid; a valid batch
+    is appended under the labels lock with a single write and fsync.
+    """
+    data = request.get_json(silent=True) or {}
+    labels = data.get('labels')
+    if not isinstance(labels, list) or not labels:
+        return jsonify({"success": False, "message": "Expected a non-empty list of labels"}), 400
+    if len(labels) > BATCH_MAX_LABELS:
+        return jsonify({"success": False, "message": f"At most {BATCH_MAX_LABELS} labels per request"}), 400
+    errors = [{"index": i, "message": message} for i, message in enumerate(map(label_error, labels)) if message]
+    if errors:
+        return jsonify({"success": False, "message": f"{len(errors)} invalid labels; nothing was saved",
+                        "errors": errors}), 400
+    try:
+        batch = [make_label(label) for label in labels]
+        commit_labels(batch)
+    except Exception as e:
+        app.logger.error(f"Error saving {len(labels)} labels: {e}")
+        return jsonify({"success": False, "message": f"Error saving labels: {str(e)}"}), 500
+    app.logger.info(f"Saved {len(batch)} labels to {LABELS_FILE}")
+    return jsonify({"success": True, "message": f"Saved {len(batch)} labels to {LABELS_FILE}", "saved": len(batch)})
+
+
 @app.route('/download_labels')
 def download_labels():
     """Download the labeled segments CSV file"""
-    output_file = "/opt/data/labeled-segments.csv"
+    output_file = LABELS_FILE
     
     if os.path.exists(output_file):
         return send_file(output_file, as_attachment=True, download_name="labeled-segments.csv")
@@ -456,29 +2762,13 @@ def download_labels():
 @app.route('/view_labels')
 def view_labels():
     """View the labeled segments as JSON for display in the interface"""
-    output_file = "/opt/data/labeled-segments.csv"
-    
-    if not os.path.exists(output_file):
+    if not os.path.exists(LABELS_FILE):
         return jsonify({"success": False, "message": "No labeled segments file found", "data": []})
     
     try:
-        labeled_segments = []
-        with open(output_file, 'r', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            for row in reader:
-                # Ensure all expected fields exist with defaults
-                segment = {
-                    'record_id': row.get('record_id', ''),
-                    'audio_file': row.get('audio_file', ''),
-                    'error_phrase': row.get('error_phrase', ''),  # Handle missing column
-                    'start_time': row.get('start_time', '0'),
-                    'end_time': row.get('end_time', '0'),
-                    'duration': row.get('duration', '0'),
-                    'labeled_at': row.get('labeled_at', '')
-                }
-                labeled_segments.append(segment)
-        
-        return jsonify({
+        labels = read_labels()
+        labeled_segments = labels['rows']
+        return versioned_json('labels', (labels['file_id'], labels['offset']), lambda: {
             "success": True,
             "message": f"Found {len(labeled_segments)} labeled segments",
             "data": labeled_segments
@@ -491,84 +2781,652 @@ def view_labels():
 @app.route('/delete_labels', methods=['POST'])
 def delete_labels():
     """Delete the labeled segments file"""
-    output_file = "/opt/data/labeled-segments.csv"
+    output_file = LABELS_FILE
     
     try:
-        if os.path.exists(output_file):
+        lock_file = labels_lock(exclusive=True)
+        try:
+            if not os.path.exists(output_file):
+                return jsonify({"success": False, "message": "No labeled segments file found to delete"})
             os.remove(output_file)
-            return jsonify({"success": True, "message": "All labeled segments deleted successfully"})
-        else:
-            return jsonify({"success": False, "message": "No labeled segments file found to delete"})
+        finally:
+            lock_file.close()
+        return jsonify({"success": True, "message": "All labeled segments deleted successfully"})
     except Exception as e:
         return jsonify({"success": False, "message": f"Error deleting labels file: {str(e)}"})
 
 
+# Prefetch
+
+def prefetch_superseded(client, token):
+    """True once the client has sent a newer prefetch request, to this worker or another one"""
+    if prefetch_tokens.get(client) != token:
+        return True
+    conn = state_db()
+    try:
+        row = conn.execute('SELECT token FROM prefetch WHERE client = ?', (client,)).fetchone()
+    finally:
+        conn.close()
+    return row is not None and row[0] != token
+
+
+def prefetch_record(record, client, token):
+    """
+    Warms file metadata, waveform peaks and the segment cache for one error record.
+    Stops between stages once a newer prefetch request of the same client has superseded this one.
+    """
+    audio_path = resolve_audio_path(record['record_file'])
+    if not audio_path:
+        return
+    stages = (
+        lambda: get_audio_info(audio_path),
+        lambda: generate_peaks(audio_path),
+        lambda: get_segment(audio_path, record['record_time'], record['record_time']).close(),
+        lambda: get_boundaries(audio_path, record['record_time'])
+    )
+    for stage in stages:
+        if prefetch_superseded(client, token):
+            return
+        try:
+            stage()
+        except Exception as e:
+            app.logger.warning(f"Prefetch of record {record['record_id']} failed: {e}")
+            return
+
+
+@app.route('/prefetch', methods=['POST'])
+def prefetch():
+    """
+    Warms caches for the error records after `index` in the loaded CSV so the
+    next steps of the labeling workflow load instantly.
+    Expected data: index, optional count (default 3, at most 10; 0 only cancels),
+    optional client_id (else a cookie identifies the client).
+    The client's previous prefetch request is cancelled: its queued work in this
+    worker right away, and its work in any worker before the next stage.
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        index = int(data['index'])
+        count = min(max(int(data.get('count', PREFETCH_DEFAULT_COUNT)), 0), PREFETCH_MAX_COUNT)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"success": False, "message": "Missing or invalid index"})
+    client = str(data.get('client_id') or request.cookies.get(PREFETCH_CLIENT_COOKIE) or uuid.uuid4().hex)
+    token = uuid.uuid4().hex
+
+    now = time.time()
+    conn = state_db()
+    try:
+        conn.execute('INSERT OR REPLACE INTO prefetch (client, token, updated_at) VALUES (?, ?, ?)',
+                     (client, token, now))
+        conn.execute('DELETE FROM prefetch WHERE updated_at < ?', (now - PREFETCH_CLIENT_TTL,))
+    finally:
+        conn.close()
+
+    with prefetch_lock:
+        # Forget clients whose work has finished
+        for other in [other for other, futures in prefetch_futures.items() if all(f.done() for f in futures)]:
+            del prefetch_futures[other]
+            prefetch_tokens.pop(other, None)
+        prefetch_tokens[client] = token
+        cancelled = sum(future.cancel() for future in prefetch_futures.pop(client, []))
+        records = csv_error_data[index + 1:index + 1 + count] if index >= -1 else []
+        prefetch_futures[client] = [prefetch_executor.submit(prefetch_record, record, client, token)
+                                    for record in records]
+    response = jsonify({
+        "success": True,
+        "message": f"Prefetching {len(records)} records",
+        "queued": len(records),
+        "cancelled": cancelled
+    })
+    if not data.get('client_id') and request.cookies.get(PREFETCH_CLIENT_COOKIE) != client:
+        response.set_cookie(PREFETCH_CLIENT_COOKIE, client, samesite='Lax')
+    return response
+
+
+# Speech boundary suggestions
+
+def boundary_db():
+    """Returns a connection to the boundary suggestion cache, creating the schema on first use"""
+    global boundary_ready
+    conn = connect_db(BOUNDARY_DB)
+    if not boundary_ready:
+        conn.execute('CREATE TABLE IF NOT EXISTS boundaries (key TEXT PRIMARY KEY, start REAL, end REAL)')
+        boundary_ready = True
+    return conn
+
+
+def boundary_key(audio_path, record_time):
+    """Cache key for a suggestion; changes when the file or the detector changes"""
+    st = os.stat(audio_path)
+    key = f"{BOUNDARY_VERSION}:{os.path.realpath(audio_path)}:{st.st_mtime_ns}:{st.st_size}:{record_time:.3f}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def pcm_to_mono(pcm, channels, sample_width):
+    """Converts interleaved little-endian PCM to a mono float32 array in [-1, 1]"""
+    return pcm_to_float(pcm, channels, sample_width).mean(axis=1)
+
+
+def detect_speech_span(samples, sample_rate, offset, record_time):
+    """
+    Finds the stretch of speech around record_time in a mono window that starts at `offset`
+    seconds. Frames count as speech when they are well above the window's noise floor, or
+    moderately above it with many zero crossings (fricatives). Returns (start, end) in
+    seconds, or None if the window has no clear speech.
+    """
+    frame = max(int(BOUNDARY_FRAME * sample_rate), 1)
+    hop = max(int(BOUNDARY_HOP * sample_rate), 1)
+    if len(samples) < frame:
+        return None
+    frames = np.lib.stride_tricks.sliding_window_view(samples, frame)[::hop]
+    energy_db = 10 * np.log10(np.mean(frames ** 2, axis=1) + 1e-10)
+    zero_crossings = np.mean(np.signbit(frames[:, 1:]) != np.signbit(frames[:, :-1]), axis=1)
+    floor, peak = np.percentile(energy_db, [10, 99])
+    if peak - floor < 6:
+        return None
+    threshold = floor + max(6, 0.3 * (peak - floor))
+    speech = (energy_db > threshold) | ((energy_db > floor + 3) & (zero_crossings > 0.3))
+
+    # Runs of speech frames as [first, last + 1); merge across short pauses, drop short bursts
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], speech.astype(np.int8), [0]))))
+    starts, ends = edges[::2], edges[1::2]
+    if not len(starts):
+        return None
+    keep_gap = (starts[1:] - ends[:-1]) * hop >= BOUNDARY_MIN_GAP * sample_rate
+    starts, ends = starts[np.concatenate(([True], keep_gap))], ends[np.concatenate((keep_gap, [True]))]
+    long_enough = (ends - starts) * hop >= BOUNDARY_MIN_SPEECH * sample_rate
+    starts, ends = starts[long_enough], ends[long_enough]
+    if not len(starts):
+        return None
+
+    # The run that contains record_time, else the closest one
+    start_times = offset + starts * hop / sample_rate
+    end_times = offset + ((ends - 1) * hop + frame) / sample_rate
+    distance = np.maximum(np.maximum(start_times - record_time, record_time - end_times), 0)
+    best = int(np.argmin(distance))
+    window_end = offset + len(samples) / sample_rate
+    return (round(max(start_times[best] - BOUNDARY_PADDING, offset), 3),
+            round(min(end_times[best] + BOUNDARY_PADDING, window_end), 3))
+
+
+def compute_boundaries(item):
+    """
+    Process pool task: suggests boundaries for one record from the /audio_segment window
+    around it. Returns (key, start, end); start and end are None if no speech was found,
+    and the result is None if the audio could not be read.
+    """
+    key, audio_path, record_time = item
+    try:
+        seg_start, seg_end = segment_window(audio_path, record_time, record_time)
+        pcm, sample_rate, channels, sample_width = read_segment_pcm(audio_path, seg_start, seg_end)
+    except Exception:
+        return None
+    span = detect_speech_span(pcm_to_mono(pcm, channels, sample_width), sample_rate, seg_start, record_time)
+    return (key, *span) if span else (key, None, None)
+
+
+def store_boundaries(results):
+    conn = boundary_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        conn.executemany('INSERT OR REPLACE INTO boundaries (key, start, end) VALUES (?, ?, ?)', results)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+
+def get_boundaries(audio_path, record_time):
+    """
+    Returns the suggested (start, end) for a record, or (None, None) when there is no
+    clear speech, computing it on the decode pool and caching it on a miss.
+    """
+    key = boundary_key(audio_path, record_time)
+    conn = boundary_db()
+    try:
+        row = conn.execute('SELECT start, end FROM boundaries WHERE key = ?', (key,)).fetchone()
+    finally:
+        conn.close()
+    if row is not None:
+        return row
+    result = run_decode(compute_boundaries, (key, audio_path, record_time))
+    if result is None:
+        raise RuntimeError(f"Could not read audio from {audio_path}")
+    store_boundaries([result])
+    return result[1:]
+
+
+def suggest_all_boundaries(workers=BOUNDARY_WORKERS, on_progress=None):
+    """
+    Computes boundary suggestions for every loaded error record that has none cached yet,
+    in parallel processes. on_progress(done, total) is called as results come in.
+    Returns (computed, unresolved) counts.
+    """
+    pending, unresolved = [], 0
+    conn = boundary_db()
+    try:
+        for record in csv_error_data:
+            audio_path = resolve_audio_path(record['record_file'])
+            if not audio_path:
+                unresolved += 1
+                continue
+            key = boundary_key(audio_path, record['record_time'])
+            if conn.execute('SELECT 1 FROM boundaries WHERE key = ?', (key,)).fetchone() is None:
+                pending.append((key, audio_path, record['record_time']))
+    finally:
+        conn.close()
+    batch, done = [], 0
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        for result in pool.map(compute_boundaries, pending, chunksize=16):
+            done += 1
+            if result is not None:
+                batch.append(result)
+            if len(batch) >= 500:
+                store_boundaries(batch)
+                batch = []
+            if on_progress and (done % 500 == 0 or done == len(pending)):
+                on_progress(done, len(pending))
+    if batch:
+        store_boundaries(batch)
+    return len(pending), unresolved
+
+
+def run_boundaries_job(job_id, workers):
+    """Background thread body for the /suggest_boundaries endpoint"""
+    try:
+        computed, unresolved = suggest_all_boundaries(
+            workers, lambda done, total: update_job(job_id, rows=done, message=f"{done}/{total} records analyzed"))
+        update_job(job_id, status='done', rows=computed,
+                   message=f"Suggested boundaries for {computed} records ({unresolved} without audio)")
+    except Exception as e:
+        app.logger.error(f"Boundary suggestion failed: {e}")
+        update_job(job_id, status='failed', message=str(e))
+
+
+@app.route('/boundaries/<record_id>')
+def get_record_boundaries(record_id):
+    """
+    Suggests where the speech around an error record starts and ends, so the labeling
+    page can pre-place the region. start/end are null when no clear speech was found.
+    """
+    record = find_record(record_id)
+    if record is None:
+        return jsonify({"success": False, "message": f"Record {record_id} not found"}), 404
+    audio_path = resolve_audio_path(record['record_file'])
+    if not audio_path:
+        return jsonify({"success": False, "message": "Audio file not found"}), 404
+    try:
+        start, end = get_boundaries(audio_path, record['record_time'])
+    except DecoderBusy:
+        return jsonify({"success": False, "message": "Server busy decoding audio, retry shortly"}), \
+            503, {'Retry-After': str(DECODE_RETRY_AFTER)}
+    except Exception as e:
+        app.logger.error(f"Error suggesting boundaries for record {record_id}: {e}")
+        return jsonify({"success": False, "message": f"Error suggesting boundaries: {str(e)}"}), 500
+    return jsonify({"success": True, "record_id": record['record_id'], "record_time": record['record_time'],
+                    "start": start, "end": end})
+
+
+@app.route('/suggest_boundaries', methods=['POST'])
+def start_suggest_boundaries():
+    """
+    Starts computing boundary suggestions for all loaded error records as a background job.
+    Progress is available from /jobs/<job_id>.
+    """
+    if not csv_file_loaded:
+        return jsonify({"success": False, "message": "No CSV data loaded"})
+    workers = min(max(request.form.get('workers', BOUNDARY_WORKERS, type=int), 1), BOUNDARY_WORKERS)
+    job_id = create_job('boundaries', 0)
+    threading.Thread(target=run_boundaries_job, args=(job_id, workers), daemon=True).start()
+    return jsonify({"success": True, "message": f"Analyzing {len(csv_error_data)} records", "job_id": job_id})
+
+
+@app.cli.command('suggest-boundaries')
+@click.option('--workers', default=BOUNDARY_WORKERS, show_default=True, help='Number of analysis processes.')
+def suggest_boundaries_command(workers):
+    """Precompute speech boundary suggestions for every error record."""
+    refresh_shared_state()
+    computed, unresolved = suggest_all_boundaries(workers, lambda done, total: click.echo(f"{done}/{total} records"))
+    click.echo(f"Suggested boundaries for {computed} records; {unresolved} records have no audio file")
+
+
+# Bulk dataset export
+
+def plan_export(output_dir, shard_size):
+    """
+    Groups the saved labels by source file and splits the sources into shards.
+    The plan is written to plan.json together with the identity and size of the labels
+    file, so an interrupted export resumes with the same shards, while an export after
+    more labels were saved starts over with a new plan.
+    """
+    plan_path = os.path.join(output_dir, 'plan.json')
+    labels = read_labels()
+    identity = {
+        'labels_file': os.path.abspath(LABELS_FILE),
+        'file_id': list(labels['file_id']) if labels['file_id'] else None,
+        'size': labels['offset'],
+        'shard_size': shard_size
+    }
+    if os.path.exists(plan_path):
+        with open(plan_path, 'r', encoding='utf-8') as f:
+            plan = json.load(f)
+        if plan.get('labels') == identity:
+            return plan
+        # The labels changed since this plan was made: its shards are stale
+        for name in os.listdir(output_dir):
+            if name.startswith('shard-') or name == 'manifest.jsonl':
+                os.remove(os.path.join(output_dir, name))
+
+    sources, unresolved = {}, set()
+    for row_index, label in enumerate(labels['rows']):
+        source = resolve_audio_path(label['audio_file'])
+        if not source:
+            unresolved.add(label['audio_file'])
+            continue
+        record_id = re.sub(r'[^\w.-]', '_', label['record_id'])
+        sources.setdefault(source, []).append(dict(label, clip=f"{record_id}_{row_index:06d}.wav"))
+    ordered = sorted(sources.items())
+    plan = {
+        'labels': identity,
+        'shards': [[{'source': source, 'labels': labels} for source, labels in ordered[i:i + shard_size]]
+                   for i in range(0, len(ordered), shard_size)],
+        'unresolved': sorted(unresolved)
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(plan_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(plan, f)
+    os.replace(plan_path + '.tmp', plan_path)
+    return plan
+
+
+def export_shard(shard_index, sources, output_dir):
+    """
+    Process pool task: cuts the labeled regions of a shard's source files and writes
+    them to shard-NNNNN.tar with a per-shard manifest. PCM WAV regions are read straight
+    from the file; for other formats nearby regions share one decode (see span_windows).
+    Shards whose archive already exists are skipped. Returns the manifest entries.
+    """
+    shard_name = f'shard-{shard_index:05d}'
+    tar_path = os.path.join(output_dir, shard_name + '.tar')
+    manifest_path = os.path.join(output_dir, shard_name + '.jsonl')
+    if os.path.exists(tar_path) and os.path.exists(manifest_path):
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    entries = []
+    with tarfile.open(tar_path + '.partial', 'w') as tar:
+        for item in sources:
+            source = item['source']
+            windows = [(label, float(label['start_time']), float(label['end_time'])) for label in item['labels']]
+            for span in span_windows(source, windows):
+                span_start = span[0][1]
+                span_end = max(window[2] for window in span)
+                pcm, sample_rate, channels, sample_width = read_segment_pcm(source, span_start, span_end)
+                span_offset = int(span_start * sample_rate)
+                frame_size = channels * sample_width
+                total_frames = len(pcm) // frame_size
+                for label, label_start, label_end in span:
+                    first = min(max(int(label_start * sample_rate) - span_offset, 0), total_frames)
+                    last = min(max(int(label_end * sample_rate) - span_offset, first), total_frames)
+                    clip = pcm_to_wav_bytes(pcm[first * frame_size:last * frame_size], sample_rate, channels, sample_width)
+                    member = tarfile.TarInfo(label['clip'])
+                    member.size = len(clip)
+                    member.mtime = int(time.time())
+                    tar.addfile(member, BytesIO(clip))
+                    entries.append({
+                        'clip': label['clip'],
+                        'shard': shard_name + '.tar',
+                        'record_id': label['record_id'],
+                        'audio_file': label['audio_file'],
+                        'source': source,
+                        'error_phrase': label['error_phrase'],
+                        'start_time': label['start_time'],
+                        'end_time': label['end_time'],
+                        'duration': round((last - first) / sample_rate, 3),
+                        'labeled_at': label['labeled_at'],
+                        'sample_rate': sample_rate,
+                        'channels': channels
+                    })
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        f.writelines(json.dumps(entry) + '\n' for entry in entries)
+    # The manifest goes first so an existing archive always has one
+    os.replace(manifest_path + '.tmp', manifest_path)
+    os.replace(tar_path + '.partial', tar_path)
+    return entries
+
+
+def export_labels(output_dir=EXPORT_DIR, workers=EXPORT_WORKERS, shard_size=EXPORT_SHARD_SIZE, on_progress=None):
+    """
+    Exports every labeled region as an individual WAV clip, fanning the shards
+    out over a process pool. Re-running with the same output directory resumes
+    an interrupted export. Writes manifest.jsonl and returns a summary dict.
+    """
+    plan = plan_export(output_dir, shard_size)
+    shards = plan['shards']
+    results = [None] * len(shards)
+    # spawn avoids forking a process that runs server threads
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = {pool.submit(export_shard, i, shard, output_dir): i for i, shard in enumerate(shards)}
+        for done, future in enumerate(as_completed(futures), 1):
+            results[futures[future]] = future.result()
+            if on_progress:
+                on_progress(done, len(shards))
+    manifest_path = os.path.join(output_dir, 'manifest.jsonl')
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        for entries in results:
+            f.writelines(json.dumps(entry) + '\n' for entry in entries)
+    return {
+        "output_dir": output_dir,
+        "shards": len(shards),
+        "clips": sum(len(entries) for entries in results),
+        "unresolved_files": plan['unresolved'],
+        "manifest": manifest_path
+    }
+
+
+def run_export_job(job_id, output_dir, workers, shard_size):
+    """Background thread body for the /export_labels endpoint"""
+    try:
+        summary = export_labels(output_dir, workers, shard_size,
+                                lambda done, total: update_job(job_id, rows=done, message=f"{done}/{total} shards done"))
+        update_job(job_id, status='done',
+                   message=f"Exported {summary['clips']} clips in {summary['shards']} shards to {output_dir}")
+    except Exception as e:
+        app.logger.error(f"Label export to '{output_dir}' failed: {e}")
+        update_job(job_id, status='failed', message=str(e))
+
+
+@app.route('/export_labels', methods=['POST'])
+def start_export_labels():
+    """
+    Starts a bulk export of all labeled segments as a background job.
+    output_dir is a directory under EXPORT_DIR (the CLI command takes any path).
+    Progress (shards done) is available from /jobs/<job_id>.
+    """
+    export_root = os.path.realpath(EXPORT_DIR)
+    output_dir = os.path.realpath(os.path.join(export_root, request.form.get('output_dir', '')))
+    if os.path.commonpath([output_dir, export_root]) != export_root:
+        return jsonify({"success": False, "message": f"output_dir must be a directory under {EXPORT_DIR}"}), 400
+    workers = min(max(request.form.get('workers', EXPORT_WORKERS, type=int), 1), EXPORT_WORKERS)
+    shard_size = max(request.form.get('shard_size', EXPORT_SHARD_SIZE, type=int), 1)
+    if not os.path.exists(LABELS_FILE):
+        return jsonify({"success": False, "message": "No labeled segments file found"})
+    job_id = create_job('export', 0)
+    threading.Thread(target=run_export_job, args=(job_id, output_dir, workers, shard_size), daemon=True).start()
+    return jsonify({"success": True, "message": f"Exporting labeled segments to {output_dir}", "job_id": job_id})
+
+
+@app.cli.command('export-labels')
+@click.option('--output-dir', default=EXPORT_DIR, show_default=True, help='Directory for shards and manifest.')
+@click.option('--workers', default=EXPORT_WORKERS, show_default=True, help='Number of export processes.')
+@click.option('--shard-size', default=EXPORT_SHARD_SIZE, show_default=True, help='Source files per shard.')
+def export_labels_command(output_dir, workers, shard_size):
+    """Export labeled segments as sharded WAV archives (resumable)."""
+    refresh_shared_state()
+    summary = export_labels(output_dir, workers, shard_size,
+                            lambda done, total: click.echo(f"{done}/{total} shards done"))
+    click.echo(f"Exported {summary['clips']} clips in {summary['shards']} shards; manifest: {summary['manifest']}")
+    if summary['unresolved_files']:
+        click.echo(f"Skipped labels for {len(summary['unresolved_files'])} files not found in {current_directory}")
+
+
 # Auto-load CSV and audio files on startup
+
+def snapshot_path(kind, source_path):
+    """Returns the snapshot file for parsed data, keyed by the source's path, mtime and size"""
+    st = os.stat(source_path)
+    key = f"{kind}:{SNAPSHOT_FORMAT}:{os.path.realpath(source_path)}:{st.st_mtime_ns}:{st.st_size}"
+    return os.path.join(SNAPSHOT_DIR, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.pickle')
+
+
+def load_snapshot(path):
+    """
+    Returns (data, pickled bytes) from a snapshot, or (None, None) if there is no usable one.
+    The bytes are handed to publish_state as they are, so they're not pickled again.
+    """
+    try:
+        with open(path, 'rb') as f:
+            payload = f.read()
+        return pickle.loads(payload), payload
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        app.logger.warning(f"Ignoring unreadable snapshot {path}: {e}")
+        return None, None
+
+
+def save_snapshot(path, value):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+def set_startup_status(ready, message):
+    startup_status.update(ready=ready, message=message)
+    publish_state('startup', dict(startup_status, run=server_run_id()))
+
+
 def auto_load_data():
-    """Try to auto-load CSV and audio files from default locations"""
-    global csv_error_data, csv_file_loaded, current_directory, current_playlist, audio_file_map
+    """
+    Try to auto-load CSV and audio files from default locations.
+    The playlist comes straight from the persistent catalog and the CSV from a snapshot
+    when its source is unchanged, so a restart is ready without walking or parsing;
+    the directory is then rescanned for changes after the server is ready.
+    """
+    global current_directory, current_playlist, audio_index, audio_metadata
+    started = time.perf_counter()
     
     # Auto-load audio directory
-    audio_path = "/opt/audio"
+    audio_path = STARTUP_AUDIO_DIR
+    rescan_needed = False
     if os.path.exists(audio_path) and os.path.isdir(audio_path):
         try:
             current_directory = audio_path
-            current_playlist = []
-            audio_file_map = {}
-            
-            # Recursively load all audio files
-            for root, _, files in os.walk(audio_path):
-                for filename in files:
-                    if filename.lower().endswith(SUPPORTED_AUDIO_EXTENSIONS):
-                        full_path = os.path.join(root, filename)
-                        current_playlist.append(full_path)
-                        # Map full filename and filename without extension
-                        audio_file_map[filename] = full_path
-                        name_without_ext = os.path.splitext(filename)[0]
-                        audio_file_map[name_without_ext] = full_path
-            
-            current_playlist.sort()
+            current_playlist, audio_index, audio_metadata = load_audio_directory(audio_path, rescan=False)
+            # First start: nothing catalogued yet, so the walk can't be deferred
+            rescan_needed = bool(current_playlist)
+            if not current_playlist:
+                current_playlist, audio_index, audio_metadata = load_audio_directory(audio_path)
+            publish_state('directory', audio_path)
             app.logger.info(f"Auto-loaded {len(current_playlist)} audio files from {audio_path}")
             
         except Exception as e:
             app.logger.error(f"Failed to auto-load audio files: {e}")
     
     # Auto-load CSV file - try both possible names
-    csv_path = "/opt/data/err-dataset-orig.csv"
-    if not os.path.exists(csv_path):
-        csv_path = "/opt/data/err-dataset.csv"
-    if os.path.exists(csv_path):
+    csv_path = next((path for path in STARTUP_CSV_PATHS if os.path.exists(path)), None)
+    if csv_path:
         try:
-            with open(csv_path, 'r', encoding='utf-8') as f:
-                csv_content = f.read()
-            
-            csv_error_data = []
-            reader = csv.DictReader(StringIO(csv_content))
-            
-            for row in reader:
-                if all(col in row for col in ['recordErrorID', 'recordFile', 'exampleExample', 'recordTime']):
-                    try:
-                        record_time = time_to_seconds(row['recordTime']) if row['recordTime'].strip() else 0.0
-                        record_file = row['recordFile'].strip()
-                        
-                        if record_file:  # Skip empty filenames
-                            csv_error_data.append({
-                                'record_id': row['recordErrorID'],
-                                'record_file': record_file,
-                                'example_phrase': row['exampleExample'],
-                                'record_time': record_time
-                            })
-                    except (ValueError, AttributeError):
-                        continue  # Skip rows with invalid time values
-            
-            csv_file_loaded = True
-            app.logger.info(f"Auto-loaded CSV with {len(csv_error_data)} error records")
+            snapshot = snapshot_path('csv', csv_path)
+            records, payload = load_snapshot(snapshot)
+            if records is None:
+                with open(csv_path, 'rb') as f:
+                    load_data_stream('csv', f)
+                save_snapshot(snapshot, csv_error_data)
+            else:
+                apply_shared_state('csv', records)
+                publish_state('csv', records, payload)
+            app.logger.info(f"Auto-loaded CSV with {len(csv_error_data)} error records"
+                            f"{'' if records is None else ' from snapshot'}")
+            report_record_file_matches()
             
         except Exception as e:
             app.logger.error(f"Failed to auto-load CSV: {e}")
 
+    set_startup_status(True, f"Ready in {time.perf_counter() - started:.2f}s")
+    app.logger.info(startup_status['message'])
+
+    if current_directory == audio_path:
+        if rescan_needed:
+            playlist, path_index, metadata = load_audio_directory(audio_path)
+            if playlist != current_playlist:
+                current_playlist, audio_index, audio_metadata = playlist, path_index, metadata
+                publish_state('directory', audio_path)
+                app.logger.info(f"Rescan of {audio_path} found {len(current_playlist)} audio files")
+        watch_audio_directory(audio_path)
+        schedule_peaks_generation(current_playlist)
+        schedule_proxy_generation(current_playlist)
+        schedule_metadata_probe(audio_path)
+
+
+def run_auto_load():
+    try:
+        auto_load_data()
+    except Exception as e:
+        app.logger.error(f"Startup loading failed: {e}")
+        set_startup_status(True, f"Startup loading failed: {e}")
+
+
+def start_auto_load():
+    """
+    Starts auto_load_data in a background thread so the server accepts requests immediately.
+    Called once per process (from __main__ or gunicorn's post_worker_init hook, or on the
+    first request under other launchers such as flask run). The first worker to take the
+    startup lock does the load and keeps the lock while it lives; the others receive the
+    data through the shared state store. The load runs once per server run: a worker that
+    replaces the loading one (after a timeout or crash) only syncs if it had finished.
+    """
+    global startup_lock_file, startup_attempted
+    startup_attempted = True
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    lock_file = open(os.path.join(CACHE_DIR, 'startup.lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return False
+    startup_lock_file = lock_file
+    status = read_shared_state('startup')
+    if status and status.get('run') == server_run_id() and status['ready']:
+        # Loading again would reset /ready in every worker and replace the directory
+        # and CSV loaded since with the startup ones
+        refresh_shared_state()
+        return False
+    set_startup_status(False, "Loading data")
+    threading.Thread(target=run_auto_load, daemon=True).start()
+    return True
+
+
+@app.before_request
+def start_auto_load_lazily():
+    """Starts the startup load on the first request when the launcher didn't (e.g. flask run)"""
+    if not startup_attempted:
+        start_auto_load()
+
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: 200 once the startup data is loaded, 503 until then"""
+    return jsonify({"success": startup_status['ready'], **startup_status}), 200 if startup_status['ready'] else 503
+
 
 if __name__ == '__main__':
-    # Auto-load CSV and audio files on startup
-    auto_load_data()
+    reset_metrics(uuid.uuid4().hex)
+    # Auto-load CSV and audio files in the background while the server starts
+    start_auto_load()
     app.run(debug=True, host='0.0.0.0', port=3000)
@@ -0,0 +1,410 @@
+"""
+Load-test and micro-benchmark suite for the speech labeling app.
+
+Generates a synthetic corpus (WAV/MP3 files, err-dataset.csv and a
+transcription log), starts the app in-process or under gunicorn (or uses a
+running server), drives the real endpoints concurrently and reports
+p50/p95/p99 latency, throughput and peak server RSS per endpoint.
+Results are saved as JSON so runs can be compared:
+
+    python benchmark.py --files 50 --seconds 120 --output before.json
+    python benchmark.py --files 50 --seconds 120 --output after.json --compare before.json
+"""
+import os
+import sys
+import csv
+import json
+import time
+import wave
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+
+
+# Synthetic corpus
+
+def write_wav(path, seconds, rng):
+    """Writes a mono 16-bit WAV of bursty tones and noise, roughly like speech"""
+    t = np.arange(int(seconds * SAMPLE_RATE)) / SAMPLE_RATE
+    envelope = (np.sin(2 * np.pi * rng.uniform(0.2, 0.5) * t) > 0.3).astype(np.float32)
+    signal = 0.4 * np.sin(2 * np.pi * rng.uniform(120, 300) * t) + 0.05 * rng.standard_normal(len(t))
+    samples = (np.clip(signal * envelope, -1, 1) * 32767).astype(np.int16)
+    with wave.open(path, 'wb') as wav_out:
+        wav_out.setnchannels(1)
+        wav_out.setsampwidth(2)
+        wav_out.setframerate(SAMPLE_RATE)
+        wav_out.writeframes(samples.tobytes())
+
+
+def generate_corpus(work_dir, files, seconds, mp3_ratio, records_per_file, seed):
+    """
+    Creates audio/ (nested in subdirectories), err-dataset.csv and transcription-log.tsv.
+    MP3 files are converted with pydub and need ffmpeg; without it every file stays WAV.
+    Returns a dict describing the corpus.
+    """
+    rng = np.random.default_rng(seed)
+    audio_dir = os.path.join(work_dir, 'audio')
+    have_ffmpeg = shutil.which('ffmpeg') is not None
+    if mp3_ratio and not have_ffmpeg:
+        print("ffmpeg not found; generating WAV files only", file=sys.stderr)
+    names = []
+    for i in range(files):
+        subdir = os.path.join(audio_dir, f'session{i % 10:02d}')
+        os.makedirs(subdir, exist_ok=True)
+        stem = f'rec{i:05d}'
+        wav_path = os.path.join(subdir, stem + '.wav')
+        write_wav(wav_path, seconds, rng)
+        if have_ffmpeg and rng.random() < mp3_ratio:
+            from pydub import AudioSegment
+            AudioSegment.from_wav(wav_path).export(os.path.join(subdir, stem + '.mp3'), format='mp3', bitrate='64k')
+            os.remove(wav_path)
+            names.append(stem + '.mp3')
+        else:
+            names.append(stem + '.wav')
+
+    csv_path = os.path.join(work_dir, 'err-dataset.csv')
+    log_path = os.path.join(work_dir, 'transcription-log.tsv')
+    records = []
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csv_file, \
+            open(log_path, 'w', newline='', encoding='utf-8') as log_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(['recordErrorID', 'recordFile', 'exampleExample', 'recordTime'])
+        log_writer = csv.writer(log_file, delimiter='\t')
+        log_writer.writerow(['transcriptFile', 'longFormStart', 'longFormEnd', 'longFormError',
+                             'shortFormError', 'shortFormStart', 'shortFormEnd'])
+        for name in names:
+            stem = os.path.splitext(name)[0]
+            for _ in range(records_per_file):
+                record_time = float(rng.uniform(0, max(seconds - 1, 0)))
+                record_id = len(records) + 1
+                hours, rest = divmod(record_time, 3600)
+                csv_writer.writerow([record_id, stem, f'example phrase {record_id}',
+                                     f'{int(hours):02d}:{int(rest // 60):02d}:{rest % 60:05.2f}'])
+                log_writer.writerow([f'/corpus/{name}', f'{record_time:.2f}', f'{record_time + 1.5:.2f}',
+                                     f'long error {record_id}', f'short error {record_id}',
+                                     f'{record_time + 0.2:.2f}', f'{record_time + 1.2:.2f}'])
+                records.append((record_id, stem, record_time))
+    return {'audio_dir': audio_dir, 'csv_path': csv_path, 'log_path': log_path,
+            'files': names, 'records': records}
+
+
+# Servers
+
+class InProcessServer:
+    """Runs app.app on a threaded werkzeug server inside this process"""
+
+    def __init__(self, port):
+        from werkzeug.serving import make_server
+        import app as app_module
+        self.server = make_server('127.0.0.1', port, app_module.app, threaded=True)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.base_url = f'http://127.0.0.1:{port}'
+
+    def start(self):
+        self.thread.start()
+
+    def pids(self):
+        return [os.getpid()]
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class GunicornServer:
+    """Runs the app under a local gunicorn, like start.sh does"""
+
+    def __init__(self, port, workers, extra_args):
+        self.command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f'127.0.0.1:{port}',
+                        *extra_args, 'app:app']
+        self.base_url = f'http://127.0.0.1:{port}'
+        self.process = None
+
+    def start(self):
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.process = subprocess.Popen(self.command, cwd=here)
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            try:
+                urllib.request.urlopen(self.base_url + '/status', timeout=1).read()
+                return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.2)
+        raise RuntimeError("gunicorn did not come up within 30 seconds")
+
+    def pids(self):
+        children_path = f'/proc/{self.process.pid}/task/{self.process.pid}/children'
+        try:
+            with open(children_path) as f:
+                children = [int(pid) for pid in f.read().split()]
+        except OSError:
+            children = []
+        return [self.process.pid, *children]
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait(timeout=30)
+
+
+class ExternalServer:
+    """A server that is already running; RSS is not measured"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def start(self):
+        pass
+
+    def pids(self):
+        return []
+
+    def stop(self):
+        pass
+
+
+# Measurement
+
+def rss_bytes(pid):
+    """Resident set size of a process from /proc, or 0 if unavailable"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+class RssSampler:
+    """Samples the summed RSS of the server processes and keeps the peak"""
+
+    def __init__(self, pids, interval=0.05):
+        self.pids = pids
+        self.interval = interval
+        self.peak = 0
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.is_set():
+            self.peak = max(self.peak, sum(rss_bytes(pid) for pid in self.pids))
+            self.stopped.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, sum(rss_bytes(pid) for pid in self.pids))
+
+
+def http(base_url, method, path, data=None, json_body=None, headers=None):
+    """Performs one request; returns (status, response bytes)"""
+    body, request_headers = None, dict(headers or {})
+    if json_body is not None:
+        body = json.dumps(json_body).encode('utf-8')
+        request_headers['Content-Type'] = 'application/json'
+    elif data is not None:
+        body = urllib.parse.urlencode(data).encode('utf-8')
+        request_headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    req = urllib.request.Request(base_url + path, data=body, method=method, headers=request_headers)
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def run_scenario(server, name, make_request, requests, concurrency):
+    """Fires `requests` calls of make_request(i) from `concurrency` threads and summarizes them"""
+    latencies, errors, response_bytes = [], 0, 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors, response_bytes
+        method, path, kwargs = make_request(i)
+        started = time.perf_counter()
+        status, body = http(server.base_url, method, path, **kwargs)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            response_bytes += len(body)
+            if status >= 400:
+                errors += 1
+
+    with RssSampler(server.pids()) as sampler:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(one, range(requests)))
+        wall = time.perf_counter() - started
+    latencies.sort()
+    result = {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'mean_ms': sum(latencies) / len(latencies) * 1000,
+        'throughput_rps': requests / wall if wall else None,
+        'mean_response_bytes': response_bytes / requests,
+        'peak_rss_bytes': sampler.peak or None
+    }
+    print(f"{name:<18} p50 {result['p50_ms']:8.1f} ms  p95 {result['p95_ms']:8.1f} ms  "
+          f"p99 {result['p99_ms']:8.1f} ms  {result['throughput_rps']:8.1f} req/s  errors {errors}")
+    return result
+
+
+def scenarios(corpus, seed):
+    """Returns (name, make_request, is_write) tuples for the endpoints under test"""
+    rng = random.Random(seed)
+    files = corpus['files']
+    records = corpus['records']
+
+    def pick_record(i):
+        return records[(i * 7919 + rng.randrange(len(records))) % len(records)]
+
+    def audio_segment(i):
+        record_id, stem, record_time = pick_record(i)
+        name = next(f for f in files if os.path.splitext(f)[0] == stem)
+        subdir = f'session{int(stem[3:]) % 10:02d}'
+        query = urllib.parse.urlencode({'file': f'{subdir}/{name}', 'start': record_time, 'end': record_time + 1})
+        return 'GET', f'/audio_segment?{query}', {}
+
+    def save_label(i):
+        record_id, stem, record_time = pick_record(i)
+        return 'POST', '/save_label', {'json_body': {'record_id': str(record_id), 'audio_file': stem,
+                                                     'start_time': record_time, 'end_time': record_time + 1.25}}
+
+    return [
+        ('select_directory', lambda i: ('POST', '/select_directory',
+                                        {'data': {'directory_path': corpus['audio_dir']}}), True),
+        ('load_csv', lambda i: ('POST', '/load_csv', {'data': {'csv_path': corpus['csv_path']}}), True),
+        ('load_log', lambda i: ('POST', '/load_log_from_path', {'data': {'log_path': corpus['log_path']}}), True),
+        ('status', lambda i: ('GET', '/status', {}), False),
+        ('get_csv_data', lambda i: ('GET', '/get_csv_data', {}), False),
+        ('records_page', lambda i: ('GET', f'/records?cursor={(i * 50) % len(records)}&limit=50', {}), False),
+        ('audio_files_range', lambda i: ('GET', f'/audio_files/{files[i % len(files)]}',
+                                         {'headers': {'Range': 'bytes=0-262143'}}), False),
+        ('peaks', lambda i: ('GET', f'/peaks/{files[i % len(files)]}', {}), False),
+        ('audio_segment', audio_segment, False),
+        ('save_label', save_label, False),
+        ('view_labels', lambda i: ('GET', '/view_labels', {}), False),
+    ]
+
+
+def compare(current, baseline_path):
+    """Prints per-endpoint latency and throughput changes against an earlier results file"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path}:")
+    for name, result in current['endpoints'].items():
+        before = baseline.get('endpoints', {}).get(name)
+        if not before:
+            continue
+        def change(key):
+            if not before.get(key) or result.get(key) is None:
+                return '    n/a'
+            return f"{(result[key] - before[key]) / before[key] * 100:+6.1f}%"
+        print(f"{name:<18} p50 {change('p50_ms')}  p95 {change('p95_ms')}  p99 {change('p99_ms')}  "
+              f"throughput {change('throughput_rps')}  peak RSS {change('peak_rss_bytes')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=20, help='number of audio files to generate')
+    parser.add_argument('--seconds', type=float, default=60, help='length of each audio file')
+    parser.add_argument('--mp3-ratio', type=float, default=0.0, help='fraction of files stored as MP3 (needs ffmpeg)')
+    parser.add_argument('--records-per-file', type=int, default=20, help='error records per audio file')
+    parser.add_argument('--requests', type=int, default=200, help='requests per read endpoint')
+    parser.add_argument('--write-requests', type=int, default=10, help='requests per data-loading endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--server', choices=['inprocess', 'gunicorn', 'external'], default='inprocess')
+    parser.add_argument('--url', help='base URL when --server external')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--workers', type=int, default=4, help='gunicorn workers')
+    parser.add_argument('--gunicorn-args', default='', help='extra gunicorn arguments, e.g. "-k gthread --threads 8"')
+    parser.add_argument('--only', help='comma-separated endpoint names to run')
+    parser.add_argument('--work-dir', help='where to put the corpus, caches and labels (default: a temp dir)')
+    parser.add_argument('--keep', action='store_true', help='keep the work dir afterwards')
+    parser.add_argument('--seed', type=int, default=1234)
+    parser.add_argument('--output', default=f'benchmark-{time.strftime("%Y%m%d-%H%M%S")}.json')
+    parser.add_argument('--compare', help='earlier results JSON to compare against')
+    args = parser.parse_args()
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='speech-labeling-bench-')
+    os.makedirs(work_dir, exist_ok=True)
+    # Keep the app's caches and label file inside the work dir
+    os.environ['AUDIO_CACHE_DIR'] = os.path.join(work_dir, 'cache')
+    os.environ['LABELS_FILE'] = os.path.join(work_dir, 'labeled-segments.csv')
+    os.environ['STARTUP_AUDIO_DIR'] = os.path.join(work_dir, 'audio')
+    os.environ['STARTUP_CSV_PATHS'] = os.path.join(work_dir, 'err-dataset.csv')
+
+    print(f"Generating corpus in {work_dir} ...")
+    started = time.perf_counter()
+    corpus = generate_corpus(work_dir, args.files, args.seconds, args.mp3_ratio, args.records_per_file, args.seed)
+    print(f"{len(corpus['files'])} files, {len(corpus['records'])} records in {time.perf_counter() - started:.1f}s")
+
+    if args.server == 'inprocess':
+        server = InProcessServer(args.port)
+    elif args.server == 'gunicorn':
+        server = GunicornServer(args.port, args.workers, args.gunicorn_args.split())
+    else:
+        if not args.url:
+            parser.error('--url is required with --server external')
+        server = ExternalServer(args.url)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = {}
+    server.start()
+    try:
+        for name, make_request, is_write in scenarios(corpus, args.seed):
+            if only and name not in only and not is_write:
+                continue
+            count = args.write_requests if is_write else args.requests
+            # Data loads run one at a time, like a user clicking the button
+            results[name] = run_scenario(server, name, make_request, count, 1 if is_write else args.concurrency)
+    finally:
+        server.stop()
+        if not args.keep and not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(),
+                        'cpus': os.cpu_count()},
+        'corpus': {'files': len(corpus['files']), 'records': len(corpus['records']),
+                   'seconds_per_file': args.seconds},
+        'endpoints': results
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(output, f, indent=2)
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(output, args.compare)
+
+
+if __name__ == '__main__':
+    main()
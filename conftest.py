@@ -0,0 +1 @@
+# Lets pytest import the app modules (app.py, record_store.py) from the repository root
@@ -0,0 +1,36 @@
+# gunicorn.conf.py - Gunicorn settings used by start.sh (gunicorn picks this file up automatically)
+import os
+import shutil
+import uuid
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:80')
+workers = int(os.environ.get('GUNICORN_WORKERS', 4))
+
+# Threaded workers: a long audio download or a slow decode only occupies one thread,
+# so cheap requests like /status and /save_label keep being served alongside it.
+# Decoding itself is bounded separately by DECODE_WORKERS / DECODE_QUEUE_LIMIT in app.py.
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# Idle keep-alive connections wait in the worker's poller without holding a thread
+keepalive = 5
+
+# Audio files and cached segments are handed to the kernel with sendfile()
+sendfile = True
+
+timeout = 120
+graceful_timeout = 30
+
+
+def on_starting(server):
+    # Metrics start from zero with every server run: drop earlier runs' snapshots and give
+    # the workers a new run id (the same as reset_metrics in app.py, without importing the
+    # app into the master). The run id also makes the startup load happen once per run.
+    cache_dir = os.environ.get('AUDIO_CACHE_DIR', '/opt/data/cache')
+    shutil.rmtree(os.path.join(cache_dir, 'metrics'), ignore_errors=True)
+    os.environ['METRICS_RUN_ID'] = uuid.uuid4().hex
+
+
+def post_worker_init(worker):
+    # Load the default audio directory and CSV in the background (one worker does the work)
+    from app import start_auto_load
+    start_auto_load()
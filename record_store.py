@@ -0,0 +1,534 @@
+"""
+Column-oriented in-memory stores for CSV error records and transcription error segments,
+and a compact index for resolving file names to the audio files of a directory.
+
+Millions of per-row dicts cost gigabytes in every gunicorn worker, so rows are kept as
+NumPy columns instead: float64 times, integer ids into an interned file list, and one
+UTF-8 string table for the free text. Indexing a store still returns the same dicts
+the parsers used to produce, so the JSON served to the browser is unchanged.
+"""
+import os
+import bisect
+from array import array
+
+import numpy as np
+
+
+class StringTable:
+    """
+    Many strings stored as one UTF-8 buffer plus offsets; equal strings are stored once.
+    Strings are added while building, then finish() packs them and drops the lookup dict.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.pending = []
+        self.data = b''
+        self.offsets = np.zeros(1, dtype=np.int64)
+
+    def add(self, text):
+        """Returns the id of `text`, adding it if it's new"""
+        string_id = self.ids.get(text)
+        if string_id is None:
+            string_id = self.ids[text] = len(self.pending)
+            self.pending.append(text)
+        return string_id
+
+    def finish(self):
+        encoded = [text.encode('utf-8') for text in self.pending]
+        self.data = b''.join(encoded)
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+        self.offsets = np.concatenate(([0], np.cumsum(lengths))).astype(np.int64)
+        self.ids, self.pending = None, None
+        return self
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, string_id):
+        return self.data[self.offsets[string_id]:self.offsets[string_id + 1]].decode('utf-8')
+
+
+class Interner:
+    """Maps names (e.g. audio file names) to dense integer ids"""
+
+    def __init__(self):
+        self.names = []
+        self.ids = {}
+
+    def add(self, name):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+
+def file_key(name):
+    """Default key under which intervals are indexed: the file name without directory or extension"""
+    return os.path.splitext(os.path.basename(name))[0]
+
+
+class IntervalIndex:
+    """
+    Time intervals grouped by file key, sorted by start within each file, with the running
+    maximum of their ends. Overlap and nearest queries then need two binary searches plus
+    a scan of the candidates between them. Intervals with a missing (NaN) bound are left out.
+    Interval i belongs to file names[name_ids[i]]; query results are the `rows` values passed
+    in, so callers can map back to their own records. `key` maps a file name (when indexing
+    and when querying) to the file it stands for; names with the same key share intervals.
+    """
+
+    def __init__(self, names, name_ids, starts, ends, rows, key=file_key):
+        self.key = key
+        self.keys = Interner()
+        key_of_name = np.array([self.keys.add(key(name)) for name in names], dtype=np.int64)
+        key_ids = key_of_name[name_ids] if len(name_ids) else np.zeros(0, dtype=np.int64)
+        valid = ~(np.isnan(starts) | np.isnan(ends))
+        key_ids, starts, ends, rows = key_ids[valid], starts[valid], ends[valid], rows[valid]
+        order = np.lexsort((starts, key_ids))
+        self.starts = starts[order]
+        self.ends = ends[order]
+        self.rows = rows[order]
+        self.bounds = np.searchsorted(key_ids[order], np.arange(len(self.keys.names) + 1))
+        # Running max of ends within each file, and the position that holds it
+        self.max_ends = np.empty_like(self.ends)
+        self.max_positions = np.empty(len(self.ends), dtype=np.int64)
+        positions = np.arange(len(self.ends))
+        for first, last in zip(self.bounds[:-1], self.bounds[1:]):
+            ends = self.ends[first:last]
+            self.max_ends[first:last] = np.maximum.accumulate(ends)
+            is_max = ends == self.max_ends[first:last]
+            self.max_positions[first:last] = np.maximum.accumulate(np.where(is_max, positions[first:last], first))
+
+    def file_bounds(self, name):
+        key_id = self.keys.ids.get(self.key(name))
+        if key_id is None:
+            return 0, 0
+        return int(self.bounds[key_id]), int(self.bounds[key_id + 1])
+
+    def overlapping_positions(self, name, start, end):
+        """Positions (into starts/ends/rows) of the intervals of a file that overlap [start, end]"""
+        first, last = self.file_bounds(name)
+        # Candidates start no later than `end`, and lie after the last interval whose
+        # running max end is still before `start`
+        hi = first + np.searchsorted(self.starts[first:last], end, side='right')
+        lo = first + np.searchsorted(self.max_ends[first:hi], start, side='left')
+        candidates = np.arange(lo, hi)
+        return candidates[self.ends[lo:hi] >= start]
+
+    def overlapping(self, name, start, end):
+        """Rows of the intervals of a file that overlap [start, end], in start order"""
+        return self.rows[self.overlapping_positions(name, start, end)]
+
+    def nearest(self, name, time):
+        """
+        Returns (row, distance) for the interval of a file closest to `time`;
+        distance is 0 if an interval covers it. Returns None if the file has no intervals.
+        """
+        first, last = self.file_bounds(name)
+        if first == last:
+            return None
+        split = first + np.searchsorted(self.starts[first:last], time, side='right')
+        best = None
+        if split > first:
+            # Among intervals starting at or before `time`, the one reaching furthest
+            position = self.max_positions[split - 1]
+            best = (position, max(time - self.max_ends[split - 1], 0.0))
+        if split < last and (best is None or self.starts[split] - time < best[1]):
+            best = (split, self.starts[split] - time)
+        return int(self.rows[best[0]]), float(best[1])
+
+
+class GrowingIntervalIndex:
+    """
+    An IntervalIndex that intervals can be appended to without rebuilding it. Appended
+    intervals go to small per-file lists kept sorted by start, which queries search too;
+    once more than `merge_after` have piled up they are merged in with one rebuild from the
+    stored columns. Names passed in must be distinct; queries match them through `key`.
+    Appends must not run concurrently with each other; queries may run alongside them.
+    """
+
+    def __init__(self, names, name_ids, starts, ends, rows, key=file_key, merge_after=1024):
+        self.key = key
+        self.merge_after = merge_after
+        self.names = Interner()
+        for name in names:
+            self.names.add(name)
+        self.name_ids = np.asarray(name_ids, dtype=np.int64)
+        self.starts = np.asarray(starts, dtype=np.float64)
+        self.ends = np.asarray(ends, dtype=np.float64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.appended = []  # (name id, start, end, row) not merged into the index yet
+        # The index and the tail of appended intervals ({key: [(start, end, row), ...]}) are
+        # swapped together, so a query never sees merged intervals twice or not at all
+        self.state = (IntervalIndex(self.names.names, self.name_ids, self.starts, self.ends, self.rows, key), {})
+
+    def __len__(self):
+        return len(self.rows) + len(self.appended)
+
+    def append(self, name, start, end, row):
+        self.appended.append((self.names.add(name), start, end, row))
+        if not (np.isnan(start) or np.isnan(end)):
+            bisect.insort(self.state[1].setdefault(self.key(name), []), (start, end, row))
+        if len(self.appended) > self.merge_after:
+            self.merge()
+
+    def merge(self):
+        """Moves the appended intervals into the index"""
+        name_ids, starts, ends, rows = zip(*self.appended)
+        self.name_ids = np.concatenate((self.name_ids, np.array(name_ids, dtype=np.int64)))
+        self.starts = np.concatenate((self.starts, np.array(starts, dtype=np.float64)))
+        self.ends = np.concatenate((self.ends, np.array(ends, dtype=np.float64)))
+        self.rows = np.concatenate((self.rows, np.array(rows, dtype=np.int64)))
+        self.appended = []
+        self.state = (IntervalIndex(self.names.names, self.name_ids, self.starts, self.ends, self.rows, self.key), {})
+
+    def overlapping(self, name, start, end):
+        """Rows of the intervals of a file that overlap [start, end], in start order"""
+        index, tail = self.state
+        positions = index.overlapping_positions(name, start, end)
+        intervals = tail.get(self.key(name), [])
+        hi = bisect.bisect_right(intervals, (end, float('inf'), float('inf')))
+        appended = [(s, row) for s, e, row in intervals[:hi] if e >= start]
+        if not appended:
+            return index.rows[positions]
+        merged = sorted(list(zip(index.starts[positions].tolist(), index.rows[positions].tolist())) + appended)
+        return np.array([row for _, row in merged], dtype=np.int64)
+
+    def nearest(self, name, time):
+        """Same as IntervalIndex.nearest, over the indexed and the appended intervals"""
+        index, tail = self.state
+        best = index.nearest(name, time)
+        for s, e, row in tail.get(self.key(name), []):
+            distance = s - time if s > time else max(time - e, 0.0)
+            if best is None or distance < best[1]:
+                best = (int(row), float(distance))
+        return best
+
+
+class RecordTable:
+    """
+    CSV error records (record_id, record_file, example_phrase, record_time) stored by column,
+    with sorted orders for lookups by record id, by file and by time range.
+    Build it with append()/finish() or from_records(); table[i] returns the record as a dict.
+    """
+
+    def __init__(self):
+        self.files = Interner()
+        self.phrases = StringTable()
+        self._ids = []
+        self._file_ids = array('i')
+        self._phrase_ids = array('i')
+        self._times = array('d')
+
+    @classmethod
+    def from_records(cls, records):
+        table = cls()
+        for record in records:
+            table.append(record)
+        return table.finish()
+
+    def append(self, record):
+        self._ids.append(str(record['record_id']))
+        self._file_ids.append(self.files.add(record['record_file']))
+        self._phrase_ids.append(self.phrases.add(record['example_phrase']))
+        self._times.append(record['record_time'])
+
+    def finish(self):
+        self.record_ids = np.array(self._ids, dtype=str)
+        self.file_ids = np.array(self._file_ids, dtype=np.int32)
+        self.phrase_ids = np.array(self._phrase_ids, dtype=np.int32)
+        self.times = np.array(self._times, dtype=np.float64)
+        del self._ids, self._file_ids, self._phrase_ids, self._times
+        self.phrases.finish()
+        # Stable sorts keep rows in file order within equal keys, so the first
+        # occurrence of a duplicate record id wins and per-file rows stay in CSV order.
+        # Lookups pass the orders as searchsorted's sorter instead of keeping sorted copies.
+        row_dtype = np.int32 if len(self.times) < 2 ** 31 else np.int64
+        self.id_order = np.argsort(self.record_ids, kind='stable').astype(row_dtype)
+        self.file_order = np.argsort(self.file_ids, kind='stable').astype(row_dtype)
+        self.file_bounds = np.searchsorted(self.file_ids, np.arange(len(self.files.names) + 1), sorter=self.file_order)
+        self.time_order = np.argsort(self.times, kind='stable').astype(row_dtype)
+        return self
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.record(j) for j in range(*i.indices(len(self)))]
+        return self.record(i)
+
+    def __iter__(self):
+        return (self.record(i) for i in range(len(self)))
+
+    def record(self, i):
+        return {
+            'record_id': str(self.record_ids[i]),
+            'record_file': self.files.names[self.file_ids[i]],
+            'example_phrase': self.phrases[self.phrase_ids[i]],
+            'record_time': float(self.times[i])
+        }
+
+    def to_list(self):
+        return list(self)
+
+    def find(self, record_id):
+        """Returns the row index of a record id, or None"""
+        record_id = str(record_id)
+        position = np.searchsorted(self.record_ids, record_id, sorter=self.id_order)
+        if position < len(self) and self.record_ids[self.id_order[position]] == record_id:
+            return int(self.id_order[position])
+        return None
+
+    def rows_for_file(self, record_file):
+        """Row indices of a file's records, in CSV order"""
+        file_id = self.files.ids.get(record_file)
+        if file_id is None:
+            return np.zeros(0, dtype=np.int64)
+        return self.file_order[self.file_bounds[file_id]:self.file_bounds[file_id + 1]]
+
+    def rows_in_time_range(self, start=None, end=None):
+        """Row indices of records with start <= record_time <= end, in time order"""
+        lo = np.searchsorted(self.times, start, side='left', sorter=self.time_order) if start is not None else 0
+        hi = np.searchsorted(self.times, end, side='right', sorter=self.time_order) if end is not None else len(self)
+        return self.time_order[lo:hi]
+
+    def select(self, record_file=None, start=None, end=None):
+        """
+        Row indices matching an exact file and/or a time range. With a file filter rows come
+        in CSV order, with only a time range in time order, with neither in CSV order.
+        """
+        if record_file is None:
+            if start is None and end is None:
+                return np.arange(len(self))
+            return self.rows_in_time_range(start, end)
+        rows = self.rows_for_file(record_file)
+        times = self.times[rows]
+        mask = np.ones(len(rows), dtype=bool)
+        if start is not None:
+            mask &= times >= start
+        if end is not None:
+            mask &= times <= end
+        return rows[mask]
+
+
+class SegmentTable:
+    """
+    Transcription error segments stored by column and grouped by audio file.
+    Missing times are NaN internally and None in the dicts returned by get().
+    Build it with append()/finish(); get(filename) returns that file's segments in log order.
+    """
+
+    TIME_FIELDS = ('longFormStart', 'longFormEnd', 'shortFormStart', 'shortFormEnd')
+
+    def __init__(self):
+        self.files = Interner()
+        self.texts = StringTable()
+        self._file_ids = array('i')
+        self._times = {field: array('d') for field in self.TIME_FIELDS}
+        self._long_errors = array('i')
+        self._short_errors = array('i')
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a table from a dict of filename -> list of segment dicts"""
+        table = cls()
+        for filename, segments in data.items():
+            for segment in segments:
+                table.append(filename, segment)
+        return table.finish()
+
+    def append(self, filename, segment):
+        self._file_ids.append(self.files.add(filename))
+        for field in self.TIME_FIELDS:
+            value = segment[field]
+            self._times[field].append(np.nan if value is None else value)
+        self._long_errors.append(self.texts.add(segment['longFormError']))
+        self._short_errors.append(self.texts.add(segment['shortFormError']))
+
+    def finish(self):
+        file_ids = np.array(self._file_ids, dtype=np.int32)
+        # Group rows by file, keeping log order within each file
+        order = np.argsort(file_ids, kind='stable')
+        self.file_ids = file_ids[order]
+        self.times = {field: np.array(values, dtype=np.float64)[order] for field, values in self._times.items()}
+        self.long_errors = np.array(self._long_errors, dtype=np.int32)[order]
+        self.short_errors = np.array(self._short_errors, dtype=np.int32)[order]
+        del self._file_ids, self._times, self._long_errors, self._short_errors
+        self.texts.finish()
+        self.file_bounds = np.searchsorted(self.file_ids, np.arange(len(self.files.names) + 1))
+        # Per file, rows by long-form start; segments without a start sort last
+        starts = np.where(np.isnan(self.times['longFormStart']), np.inf, self.times['longFormStart'])
+        self.start_order = np.lexsort((starts, self.file_ids))
+        self.sorted_starts = starts[self.start_order]
+        return self
+
+    def interval_index(self, key=file_key):
+        """
+        IntervalIndex over the long- and short-form spans of every segment, with files
+        matched by `key`; short-form rows are offset by the number of segments (see interval()).
+        """
+        rows = np.arange(len(self.file_ids))
+        return IntervalIndex(
+            self.files.names,
+            np.concatenate((self.file_ids, self.file_ids)),
+            np.concatenate((self.times['longFormStart'], self.times['shortFormStart'])),
+            np.concatenate((self.times['longFormEnd'], self.times['shortFormEnd'])),
+            np.concatenate((rows, rows + len(rows))),
+            key)
+
+    def __len__(self):
+        """Number of files with segments"""
+        return len(self.files.names)
+
+    def __contains__(self, filename):
+        return filename in self.files.ids
+
+    def segment(self, i):
+        def time_value(field):
+            value = self.times[field][i]
+            return None if np.isnan(value) else float(value)
+        return {
+            'longFormStart': time_value('longFormStart'),
+            'longFormEnd': time_value('longFormEnd'),
+            'longFormError': self.texts[self.long_errors[i]],
+            'shortFormError': self.texts[self.short_errors[i]],
+            'shortFormStart': time_value('shortFormStart'),
+            'shortFormEnd': time_value('shortFormEnd')
+        }
+
+    def bounds(self, filename):
+        """(first, last + 1) row of a file's segments, or (0, 0)"""
+        file_id = self.files.ids.get(filename)
+        if file_id is None:
+            return 0, 0
+        return int(self.file_bounds[file_id]), int(self.file_bounds[file_id + 1])
+
+    def get(self, filename, default=None):
+        first, last = self.bounds(filename)
+        if first == last:
+            return default
+        return [self.segment(i) for i in range(first, last)]
+
+    def count(self, filename):
+        first, last = self.bounds(filename)
+        return last - first
+
+    def interval(self, row):
+        """The segment behind an IntervalIndex row, with the kind and bounds of that span"""
+        kind = 'long' if row < len(self.file_ids) else 'short'
+        segment = self.segment(row % len(self.file_ids))
+        prefix = 'longForm' if kind == 'long' else 'shortForm'
+        return dict(segment, kind=kind, start=segment[prefix + 'Start'], end=segment[prefix + 'End'])
+
+    def rows_by_start(self, filename, start=None, end=None):
+        """A file's rows whose long-form start lies in [start, end], in start order"""
+        first, last = self.bounds(filename)
+        starts = self.sorted_starts[first:last]
+        lo = np.searchsorted(starts, start, side='left') if start is not None else 0
+        hi = np.searchsorted(starts, end, side='right') if end is not None else len(starts)
+        return self.start_order[first + lo:first + hi]
+
+
+class PathIndex:
+    """
+    The audio files under a directory, resolvable by relative path, file name or stem (the
+    name without extension, as the CSV's record_file has it). Every path is kept, so files
+    with the same name in different subdirectories no longer hide each other; a name that
+    matches several files can be narrowed down with more of its path, e.g. "spk1/a.wav".
+    Relative paths live in one StringTable and are found through sorted 64-bit hashes of their
+    names and stems, so a million files cost tens of megabytes rather than a dict of strings.
+    Hashes use the per-process str hash, so an index is rebuilt in each process, not pickled.
+    """
+
+    def __init__(self, root, paths):
+        self.root = os.path.abspath(root) if root else None
+        self.paths = StringTable()
+        hashes, targets = array('q'), array('q')
+        prefix = os.path.join(self.root, '') if self.root else None
+        for path_id, full_path in enumerate(paths):
+            relative = full_path[len(prefix):] if prefix and full_path.startswith(prefix) else os.path.relpath(full_path, self.root)
+            if os.sep != '/':
+                relative = relative.replace(os.sep, '/')
+            self.paths.pending.append(relative)  # Paths are unique, so skip add()'s dedup dict
+            basename = relative.rpartition('/')[2]
+            stem = os.path.splitext(basename)[0]
+            hashes.append(hash(basename))
+            targets.append(path_id)
+            if stem != basename:
+                hashes.append(hash(stem))
+                targets.append(path_id)
+        self.paths.finish()
+        hashes = np.frombuffer(hashes, dtype=np.int64)
+        order = np.argsort(hashes, kind='stable')
+        self.hashes = hashes[order]
+        self.targets = np.frombuffer(targets, dtype=np.int64)[order].astype(np.int32)
+
+    def __len__(self):
+        return len(self.paths)
+
+    def relative(self, name):
+        """Normalizes a client or CSV file name to a relative path with '/' separators, or None"""
+        name = name.strip().replace('\\', '/')
+        if os.path.isabs(name):
+            if not self.root:
+                return None
+            name = os.path.relpath(name, self.root).replace(os.sep, '/')
+        if not name:
+            return None
+        # Collapses "./" and "x/../" parts; names that climb out of the root match nothing
+        name = os.path.normpath(name).replace(os.sep, '/')
+        if name in ('.', '..') or name.startswith('../'):
+            return None
+        return name
+
+    def candidates(self, name):
+        """Full paths of every file `name` refers to, in playlist order"""
+        name = self.relative(name)
+        if name is None:
+            return []
+        key = hash(name.rsplit('/', 1)[-1])
+        lo = np.searchsorted(self.hashes, key, side='left')
+        hi = np.searchsorted(self.hashes, key, side='right')
+        matches = []
+        for path_id in sorted(set(self.targets[lo:hi].tolist())):
+            relative = self.paths[path_id]
+            # The name matches the whole relative path or a trailing part of it, with or without extension
+            for candidate in (relative, os.path.splitext(relative)[0]):
+                if candidate == name or candidate.endswith('/' + name):
+                    matches.append(os.path.join(self.root, relative))
+                    break
+        return matches
+
+    def resolve(self, name):
+        """
+        The full path of the file `name` refers to, or None. When several files match, a file
+        directly under the root wins (the flat layout this app started with), then playlist order.
+        """
+        matches = self.candidates(name)
+        if len(matches) > 1:
+            top_level = [path for path in matches if os.path.dirname(path) == self.root]
+            if top_level:
+                return top_level[0]
+        return matches[0] if matches else None
+
+    def resolve_suffix(self, path):
+        """
+        Resolves a path recorded elsewhere, e.g. "/data/corpus/spk1/a.wav" in a log written on
+        another machine, by the longest trailing part of it that names a file here. Returns None
+        if not even the file name does.
+        """
+        parts = path.strip().replace('\\', '/').strip('/').split('/')
+        for i in range(len(parts)):
+            resolved = self.resolve('/'.join(parts[i:]))
+            if resolved:
+                return resolved
+        return None
+
+    def path_name(self, full_path):
+        """Relative path of a file under the root with '/' separators, as used in URLs"""
+        prefix = os.path.join(self.root, '')
+        relative = full_path[len(prefix):] if prefix and full_path.startswith(prefix) else os.path.relpath(full_path, self.root)
+        return relative.replace(os.sep, '/')
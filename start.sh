@@ -16,9 +16,9 @@ if [ -f requirements.txt ]; then
     pip3 install --user -r requirements.txt
 fi
 
-# Start gunicorn in daemon mode
+# Start gunicorn in daemon mode (threaded workers, see gunicorn.conf.py)
 echo "⚙️  Starting gunicorn server..."
-sudo PYTHONPATH="/home/ec2-user/.local/lib/python3.9/site-packages:$PYTHONPATH" /home/ec2-user/.local/bin/gunicorn -w 4 -b 0.0.0.0:80 --daemon app:app
+sudo PYTHONPATH="/home/ec2-user/.local/lib/python3.9/site-packages:$PYTHONPATH" /home/ec2-user/.local/bin/gunicorn -c gunicorn.conf.py --daemon app:app
 
 # Check if it started successfully
 sleep 2
@@ -32,6 +32,6 @@ if pgrep -f "gunicorn.*app:app" > /dev/null; then
 else
     echo "❌ Failed to start application!"
     echo "Check the logs or try running without daemon mode for debugging:"
-    echo "sudo PYTHONPATH=\"/home/ec2-user/.local/lib/python3.9/site-packages:\$PYTHONPATH\" /home/ec2-user/.local/bin/gunicorn -w 4 -b 0.0.0.0:80 app:app"
+    echo "sudo PYTHONPATH=\"/home/ec2-user/.local/lib/python3.9/site-packages:\$PYTHONPATH\" /home/ec2-user/.local/bin/gunicorn -c gunicorn.conf.py app:app"
     exit 1
 fi
\ No newline at end of file
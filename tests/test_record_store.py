@@ -0,0 +1,104 @@
+import numpy as np
+
+from record_store import GrowingIntervalIndex, IntervalIndex, PathIndex, RecordTable
+
+ROOT = '/data/audio'
+PATHS = [f'{ROOT}/{relative}' for relative in
+         ('a.wav', 'notes', 'spk1/a.wav', 'spk1/x.wav', 'spk2/x.wav', 'spk2/odd #name.wav')]
+
+
+def path_index():
+    return PathIndex(ROOT, PATHS)
+
+
+def test_same_name_in_different_subdirectories():
+    index = path_index()
+    assert index.candidates('x.wav') == [f'{ROOT}/spk1/x.wav', f'{ROOT}/spk2/x.wav']
+    # Without a top-level match the first in playlist order wins; more of the path narrows it down
+    assert index.resolve('x') == f'{ROOT}/spk1/x.wav'
+    assert index.resolve('spk2/x') == f'{ROOT}/spk2/x.wav'
+    assert index.resolve(f'{ROOT}/spk2/x.wav') == f'{ROOT}/spk2/x.wav'
+    # A file directly under the root wins over same-named files in subdirectories
+    assert index.resolve('a.wav') == f'{ROOT}/a.wav'
+    assert index.resolve('spk1/a.wav') == f'{ROOT}/spk1/a.wav'
+    assert index.path_name(f'{ROOT}/spk2/odd #name.wav') == 'spk2/odd #name.wav'
+
+
+def test_names_without_extension():
+    index = path_index()
+    assert index.resolve('notes') == f'{ROOT}/notes'
+    assert index.resolve('spk1/a') == f'{ROOT}/spk1/a.wav'
+    assert index.resolve('odd #name') == f'{ROOT}/spk2/odd #name.wav'
+    assert index.resolve('missing') is None
+
+
+def test_names_climbing_out_of_the_root_match_nothing():
+    index = path_index()
+    assert index.relative('../a.wav') is None
+    assert index.resolve('../audio/a.wav') is None
+    assert index.resolve('spk1/../../audio/a.wav') is None
+    assert index.resolve('/elsewhere/a.wav') is None
+    assert index.resolve('spk1/../a.wav') == f'{ROOT}/a.wav'
+
+
+def test_resolve_suffix_uses_the_longest_matching_trailing_part():
+    index = path_index()
+    assert index.resolve_suffix('/remote/corpus/spk2/x.wav') == f'{ROOT}/spk2/x.wav'
+    assert index.resolve_suffix('C:\\corpus\\spk1\\a.wav') == f'{ROOT}/spk1/a.wav'
+    # Only the file name matches, so it resolves like a bare name
+    assert index.resolve_suffix('/remote/spk9/x.wav') == f'{ROOT}/spk1/x.wav'
+    assert index.resolve_suffix('/remote/missing.wav') is None
+
+
+# One early long interval (row 0) covers intervals that start after it
+STARTS = [0.0, 10.0, 50.0, 200.0, np.nan, 5.0]
+ENDS = [100.0, 11.0, 51.0, 201.0, 1.0, 6.0]
+NAMES = ['a.wav', 'b.wav']
+NAME_IDS = [0, 0, 0, 0, 0, 1]
+
+
+def interval_index():
+    return IntervalIndex(NAMES, np.array(NAME_IDS), np.array(STARTS), np.array(ENDS), np.arange(len(STARTS)))
+
+
+def test_overlapping_finds_intervals_covered_by_an_early_long_one():
+    index = interval_index()
+    assert index.overlapping('a', 60, 70).tolist() == [0]
+    assert index.overlapping('a', 10.5, 50.5).tolist() == [0, 1, 2]
+    assert index.overlapping('a.wav', 150, 199).tolist() == []
+    assert index.overlapping('b', 0, 300).tolist() == [5]
+    assert index.overlapping('c', 0, 300).tolist() == []
+
+
+def test_nearest_prefers_a_covering_interval():
+    index = interval_index()
+    assert index.nearest('a', 75) == (0, 0.0)
+    assert index.nearest('a', 160) == (3, 40.0)
+    assert index.nearest('a', 120) == (0, 20.0)
+    assert index.nearest('c', 0) is None
+
+
+def test_growing_index_searches_appended_intervals():
+    index = GrowingIntervalIndex(NAMES, NAME_IDS, STARTS, ENDS, np.arange(len(STARTS)), merge_after=2)
+    index.append('a.wav', 30.0, 31.0, 6)
+    index.append('c.wav', 1.0, 2.0, 7)
+    assert index.overlapping('a', 10.5, 50.5).tolist() == [0, 1, 6, 2]
+    assert index.nearest('c', 5) == (7, 3.0)
+    # A third append merges the appended intervals into the index
+    index.append('a.wav', 150.0, 160.0, 8)
+    assert index.appended == []
+    assert len(index) == 9
+    assert index.overlapping('a', 10.5, 155).tolist() == [0, 1, 6, 2, 8]
+    assert index.nearest('a', 170) == (8, 10.0)
+
+
+def test_find_returns_the_first_of_duplicate_record_ids():
+    table = RecordTable.from_records([
+        {'record_id': record_id, 'record_file': 'a', 'example_phrase': '', 'record_time': float(i)}
+        for i, record_id in enumerate(['7', '3', '7', '12', 3])
+    ])
+    assert table.find('7') == 0
+    assert table.find(7) == 0
+    assert table.find('3') == 1
+    assert table.find('12') == 3
+    assert table.find('1') is None